@@ -0,0 +1,245 @@
+# api.py
+"""
+Request parsing and response building shared by app.py (Flask) and asgi.py
+(Quart), so both servers answer every route the same way.
+
+Handlers take what the framework has already read (query args as a
+MultiDict, a JSON body as a dict) and return (payload, status) for the
+caller to jsonify. They are synchronous: app.py calls them directly and
+asgi.py runs them with asyncio.to_thread. Only the crawl routes differ
+between the two servers (threads vs the async engine, live vs replayed
+streaming); their shared pieces are ndjson(), saved() and crawl_error().
+"""
+import datetime
+import functools
+import logging
+
+import orjson
+
+from schemas import dump_section, validate_context
+from context_cache import NotShopifyError
+from db import save_snapshot, load_snapshot, snapshots_page, store_history, latest_per_store, product_changes, diff_snapshots, search_snapshots, SEARCH_KINDS
+from competitors import competitor_contexts
+from shopify_insights import _domain
+import deadlines
+import jobs
+
+log = logging.getLogger("brand-insights")
+
+
+# -------------------------- parsing --------------------------
+
+def int_arg(args, name, default=None, cap=None, low=None):
+    raw = args.get(name)
+    value = int(raw) if raw not in (None, "") else default
+    if low is not None and value is not None and value < low:
+        raise ValueError(f"{name} must be at least {low}")
+    return min(value, cap) if (cap is not None and value is not None) else value
+
+
+def time_arg(args, name):
+    raw = args.get(name)
+    return datetime.datetime.fromisoformat(raw) if raw else None
+
+
+def store_key(url):
+    # brand_snapshots.store_url holds the store root as pydantic's HttpUrl renders it
+    return _domain(url).lower() + "/"
+
+
+def _store_keys(args):
+    return [store_key(u) for u in args.getlist("store_url") if u]
+
+
+# -------------------------- responses --------------------------
+
+def with_timings(ctx, trace):
+    if trace is not None:
+        ctx["_timings"] = trace.as_dict()
+    return ctx
+
+
+def ndjson(events, trace=None):
+    """One JSON line per finished section, validated field by field; ends with a "done" line."""
+    try:
+        for field, value in events:
+            try:
+                line = {"section": field, "data": dump_section(field, value)}
+            except Exception as e:
+                line = {"section": field, "error": str(e)}
+            yield orjson.dumps(line) + b"\n"
+        if trace is not None:
+            yield orjson.dumps({"section": "_timings", "data": trace.as_dict()}) + b"\n"
+        yield orjson.dumps({"section": "done"}) + b"\n"
+    except Exception as e:
+        log.exception("brand_context stream failed")
+        yield orjson.dumps({"section": "error", "error": "internal server error", "details": str(e)}) + b"\n"
+
+
+def crawl_error(e, what):
+    """(payload, status) for an exception raised by a crawl route."""
+    if isinstance(e, NotShopifyError):
+        return {"error": str(e)}, 401
+    if isinstance(e, deadlines.DeadlineExceeded):
+        return {"error": str(e)}, 504
+    log.error("%s failed", what, exc_info=e)
+    return {"error": "internal server error", "details": str(e)}, 500
+
+
+def saved(context):
+    """Validate a crawled context and store it as a snapshot."""
+    ctx = validate_context(context)
+    snapshot_id = save_snapshot(ctx["store"]["url"], ctx)
+    return {"snapshot_id": snapshot_id, "store": ctx["store"], "saved": True}, 200
+
+
+def _handler(what=None):
+    """Bad arguments (ValueError) answer 400, anything else 500 (logged when `what` is given)."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            except ValueError as e:
+                return {"error": str(e)}, 400
+            except Exception as e:
+                if what:
+                    log.exception("%s failed", what)
+                return {"error": "internal server error", "details": str(e)}, 500
+        return run
+    return wrap
+
+
+# -------------------------- snapshots --------------------------
+
+@_handler()
+def list_snapshots(args):
+    """Query: limit (max 200), before=<id cursor>, since/until=<ISO timestamps, UTC>."""
+    limit = int_arg(args, "limit", 10, 200, low=1)
+    rows = snapshots_page(int_arg(args, "before"), time_arg(args, "since"), time_arg(args, "until"), limit)
+    next_before = rows[-1]["id"] if len(rows) == limit else None
+    return {"latest": rows, "next_before": next_before}, 200
+
+
+@_handler()
+def get_snapshot(snapshot_id):
+    snap = load_snapshot(snapshot_id)
+    if snap is None:
+        return {"error": "snapshot not found"}, 404
+    return snap, 200
+
+
+@_handler()
+def get_store_history(args):
+    """Query: store_url (required), limit (max 200), before=<id cursor>."""
+    store_url = args.get("store_url")
+    if not store_url:
+        return {"error": "store_url is required"}, 400
+    limit = int_arg(args, "limit", 50, 200, low=1)
+    rows = store_history(store_key(store_url), int_arg(args, "before"), limit)
+    next_before = rows[-1]["id"] if len(rows) == limit else None
+    return {"store_url": store_key(store_url), "history": rows, "next_before": next_before}, 200
+
+
+@_handler()
+def get_latest_per_store(args):
+    """Query: limit (max 200), after=<store_url cursor>."""
+    limit = int_arg(args, "limit", 50, 200, low=1)
+    rows = latest_per_store(args.get("after"), limit)
+    next_after = rows[-1]["store_url"] if len(rows) == limit else None
+    return {"stores": rows, "next_after": next_after}, 200
+
+
+@_handler()
+def list_changes(args):
+    """Query: days (default 7) or since/until, store_url (repeatable), change, limit (max 500), before=<id cursor>."""
+    since = time_arg(args, "since") or datetime.datetime.utcnow() - datetime.timedelta(days=int_arg(args, "days", 7, low=0))
+    limit = int_arg(args, "limit", 100, 500, low=1)
+    rows = product_changes(since, time_arg(args, "until"), _store_keys(args), args.get("change"), int_arg(args, "before"), limit)
+    next_before = rows[-1]["id"] if len(rows) == limit else None
+    return {"changes": rows, "next_before": next_before}, 200
+
+
+@_handler()
+def snapshot_diff(args):
+    """Catalog diff between two snapshots: ?from=<id>&to=<id>."""
+    from_id, to_id = int_arg(args, "from"), int_arg(args, "to")
+    if from_id is None or to_id is None:
+        return {"error": "from and to snapshot ids are required"}, 400
+    diff = diff_snapshots(from_id, to_id)
+    if diff is None:
+        return {"error": "snapshot not found"}, 404
+    return diff, 200
+
+
+@_handler()
+def search(args):
+    """Query: q (required), kind (repeatable), store_url (repeatable), limit (max 100), offset."""
+    q = args.get("q")
+    if not q:
+        return {"error": "q is required"}, 400
+    kinds = [k for k in args.getlist("kind") if k]
+    unknown = sorted(set(kinds) - set(SEARCH_KINDS))
+    if unknown:
+        return {"error": f"unknown kind: {', '.join(unknown)}", "kinds": list(SEARCH_KINDS)}, 400
+    limit, offset = int_arg(args, "limit", 20, 100, low=1), int_arg(args, "offset", 0, low=0)
+    rows = search_snapshots(q, kinds, _store_keys(args), offset, limit)
+    next_offset = offset + limit if len(rows) == limit else None
+    return {"results": rows, "next_offset": next_offset}, 200
+
+
+# -------------------------- jobs --------------------------
+
+@_handler("create job")
+def create_job(data):
+    """
+    Body: {"urls": ["https://brand-a.com", "brand-b.com", ...]}
+    Queues one crawl + save per distinct store; poll /api/jobs/<id> for progress.
+    """
+    urls = data.get("urls")
+    if not isinstance(urls, list) or not urls:
+        return {"error": "urls must be a non-empty list"}, 400
+    return jobs.create_job(urls), 202
+
+
+@_handler()
+def get_job(job_id):
+    status = jobs.job_status(job_id)
+    if status is None:
+        return {"error": "job not found"}, 404
+    return status, 200
+
+
+@_handler()
+def get_job_items(job_id, args):
+    """Query: status=queued|running|done|failed, after=<last item id>, limit (max 500)."""
+    after = int_arg(args, "after", 0, low=0)
+    limit = int_arg(args, "limit", 100, 500, low=1)
+    items = jobs.job_items(job_id, args.get("status"), after, limit)
+    next_after = items[-1]["id"] if len(items) == limit else None
+    return {"job_id": job_id, "items": items, "next_after": next_after}, 200
+
+
+# -------------------------- competitors --------------------------
+
+@_handler("competitors")
+def get_competitors(data):
+    """
+    Body:
+      {
+        "website_url": "https://brand.com",
+        "loose": false,   # optional; if true, returns best-effort candidates
+        "limit": 3        # optional; default 3
+      }
+    """
+    website_url = data.get("website_url")
+    loose = bool(data.get("loose", False))
+    limit = int(data.get("limit", 3))
+
+    if not website_url:
+        return {"error": "website_url is required"}, 400
+
+    with deadlines.within(deadlines.for_request()):
+        results = competitor_contexts(website_url, limit=limit, loose=loose)
+    partial = any((r.get("context") or {}).get("partial") for r in results)
+    return {"seed": website_url, "competitors": results, "partial": partial}, 200
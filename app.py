@@ -1,18 +1,27 @@
 import logging
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
 
-from schemas import BrandContextRequest, BrandContext
-from shopify_insights import get_brand_context, is_shopify_site
-from db import save_snapshot, latest_snapshots
-from competitors import competitor_contexts
+from schemas import BrandContextRequest, validate_context
+from catalog import OrjsonProvider
+from metrics import CrawlTrace, tracing, render as render_metrics
+from shopify_insights import iter_brand_context, iter_context_sections, is_shopify_site, PageCache
+from context_cache import NotShopifyError, cache_key, crawl_context, lookup, remember
+import api
+import deadlines
+import jobs
+import singleflight
 
 app = Flask(__name__, static_folder="static")
+app.json = OrjsonProvider(app)  # catalogs serialize column-wise, no per-product models
 CORS(app)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
 log = logging.getLogger("brand-insights")
 
+# bulk crawl workers; queued items survive restarts and resume here (JOBS_WORKERS=0 disables)
+jobs.start_workers()
+
 # -------- Serve the UI at root --------
 @app.route("/", methods=["GET"])
 def serve_index():
@@ -30,71 +39,133 @@ def static_files(path):
     return send_from_directory(app.static_folder, path)
 
 # -------- API endpoints --------
+def _reply(result):
+    payload, status = result
+    return jsonify(payload), status
+
 @app.route("/api/brand-context", methods=["POST"])
 def brand_context():
+    """
+    Body: {"website_url": "https://brand.com", "stream": false, "timings": false}
+    With "stream": true (or ?stream=1) the response is application/x-ndjson:
+    {"section": <BrandContext field>, "data": ...} per extractor as it finishes,
+    whole_product_catalog once per batch of products, then {"section": "done"}.
+    With "timings": true (or ?timings=1) a "_timings" block (stage timings,
+    fetch counts, bytes, statuses, retries, parse time) is added.
+    A crawl that outlives the CRAWL_BUDGET returns the sections that finished
+    (defaults for the rest) with "partial": true.
+    """
     try:
         data = request.get_json(silent=True) or {}
         req = BrandContextRequest(**data)
-        ok, reason = is_shopify_site(req.website_url)
-        if not ok:
-            return jsonify({"error": f"website not reachable or not Shopify-like: {reason}"}), 401
+        stream = req.stream or request.args.get("stream") == "1"
+        trace = CrawlTrace() if (req.timings or request.args.get("timings") == "1") else None
+
+        deadline = deadlines.for_request()
+        with tracing(trace), deadlines.within(deadline):
+            # recently crawled (or revalidated) stores are served from the context cache
+            context = lookup(req.website_url)
+            if context is not None:
+                if trace is not None:
+                    trace.cached = True
+                    trace.finish()
+                if stream:
+                    return Response(api.ndjson(iter_context_sections(context), trace), mimetype="application/x-ndjson")
+                return jsonify(api.with_timings(validate_context(context), trace)), 200
+
+            # one cache per request: the Shopify check's homepage fetch is reused by the crawl
+            cache = PageCache()
+            if stream:
+                # a crawl of the same store already in flight is awaited and its sections replayed
+                flight = singleflight.join(cache_key(req.website_url))
+                context = singleflight.MISSING if flight.leader else flight.wait()
+                if context is not singleflight.MISSING:
+                    return Response(api.ndjson(iter_context_sections(context), trace), mimetype="application/x-ndjson")
+                try:
+                    ok, reason = is_shopify_site(req.website_url, cache)
+                except Exception:
+                    flight.finish()
+                    raise
+                if not ok:
+                    error = NotShopifyError(reason)
+                    flight.finish(error=error)
+                    return jsonify({"error": str(error)}), 401
+                events = remember(req.website_url, iter_brand_context(req.website_url, cache, trace=trace, deadline=deadline), cache, flight)
+                response = Response(stream_with_context(api.ndjson(events, trace)), mimetype="application/x-ndjson")
+                # a response closed before its body is iterated never runs remember()'s finally:
+                # give the flight up here too (a no-op once remember() has finished it)
+                response.call_on_close(flight.finish)
+                return response
 
-        context = get_brand_context(req.website_url)
+            # concurrent requests for the same store share this crawl
+            context = crawl_context(req.website_url, cache)
         # validate against schema for clean output
-        ctx = BrandContext(**context).model_dump(mode="json")
-        return jsonify(ctx), 200
+        ctx = validate_context(context)
+        return jsonify(api.with_timings(ctx, trace)), 200
     except Exception as e:
-        log.exception("brand_context failed")
-        return jsonify({"error": "internal server error", "details": str(e)}), 500
+        return _reply(api.crawl_error(e, "brand_context"))
 
 @app.route("/api/brand-context/save", methods=["POST"])
 def brand_context_and_save():
     try:
         data = request.get_json(silent=True) or {}
         req = BrandContextRequest(**data)
-        ok, reason = is_shopify_site(req.website_url)
-        if not ok:
-            return jsonify({"error": f"website not reachable or not Shopify-like: {reason}"}), 401
-
-        context = get_brand_context(req.website_url)
-        ctx = BrandContext(**context).model_dump(mode="json")
-        snapshot_id = save_snapshot(ctx["store"]["url"], ctx)
-        return jsonify({"snapshot_id": snapshot_id, "store": ctx["store"], "saved": True}), 200
+        with deadlines.within(deadlines.for_request()):
+            context = lookup(req.website_url)
+            if context is None:
+                context = crawl_context(req.website_url)
+        return _reply(api.saved(context))
     except Exception as e:
-        log.exception("save failed")
-        return jsonify({"error": "internal server error", "details": str(e)}), 500
+        return _reply(api.crawl_error(e, "save"))
 
 @app.route("/api/snapshots", methods=["GET"])
 def list_snapshots():
-    try:
-        return jsonify({"latest": latest_snapshots(10)}), 200
-    except Exception as e:
-        return jsonify({"error": "internal server error", "details": str(e)}), 500
+    return _reply(api.list_snapshots(request.args))
+
+@app.route("/api/snapshots/<int:snapshot_id>", methods=["GET"])
+def get_snapshot(snapshot_id):
+    return _reply(api.get_snapshot(snapshot_id))
+
+@app.route("/api/stores/history", methods=["GET"])
+def get_store_history():
+    return _reply(api.get_store_history(request.args))
+
+@app.route("/api/stores/latest", methods=["GET"])
+def get_latest_per_store():
+    return _reply(api.get_latest_per_store(request.args))
+
+@app.route("/api/changes", methods=["GET"])
+def list_changes():
+    return _reply(api.list_changes(request.args))
+
+@app.route("/api/snapshots/diff", methods=["GET"])
+def snapshot_diff():
+    return _reply(api.snapshot_diff(request.args))
+
+@app.route("/api/jobs", methods=["POST"])
+def create_job():
+    return _reply(api.create_job(request.get_json(silent=True) or {}))
+
+@app.route("/api/jobs/<int:job_id>", methods=["GET"])
+def get_job(job_id):
+    return _reply(api.get_job(job_id))
+
+@app.route("/api/jobs/<int:job_id>/items", methods=["GET"])
+def get_job_items(job_id):
+    return _reply(api.get_job_items(job_id, request.args))
+
+@app.route("/api/search", methods=["GET"])
+def search():
+    return _reply(api.search(request.args))
 
 @app.route("/api/competitors", methods=["POST"])
 def get_competitors():
-    """
-    Body:
-      {
-        "website_url": "https://brand.com",
-        "loose": false,   # optional; if true, returns best-effort candidates
-        "limit": 3        # optional; default 3
-      }
-    """
-    try:
-        data = request.get_json(silent=True) or {}
-        website_url = data.get("website_url")
-        loose = bool(data.get("loose", False))
-        limit = int(data.get("limit", 3))
+    return _reply(api.get_competitors(request.get_json(silent=True) or {}))
 
-        if not website_url:
-            return jsonify({"error": "website_url is required"}), 400
-
-        results = competitor_contexts(website_url, limit=limit, loose=loose)
-        return jsonify({"seed": website_url, "competitors": results}), 200
-    except Exception as e:
-        log.exception("competitors failed")
-        return jsonify({"error": "internal server error", "details": str(e)}), 500
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus text exposition of this worker's crawl and fetch metrics."""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     # TIP: run with COMP_DEBUG=1 to see competitor debug logs
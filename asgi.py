@@ -0,0 +1,160 @@
+import asyncio
+import logging
+from quart import Quart, Response, request, jsonify, send_from_directory
+from quart_cors import cors
+
+from schemas import BrandContextRequest, validate_context
+from catalog import OrjsonProvider
+from metrics import CrawlTrace, tracing, render as render_metrics
+from async_crawl import aget_brand_context, ais_shopify_site, aclose_fetcher, AsyncPageCache
+from context_cache import NotShopifyError, cache_key, lookup, store_context
+import api
+import deadlines
+import jobs
+import singleflight
+from shopify_insights import iter_context_sections
+
+# ASGI twin of app.py: same routes and payloads (both answer through api.py),
+# but crawls are awaited on the event loop instead of pinning a worker thread
+# each. Streamed brand contexts arrive once the crawl is done rather than
+# section by section. Run with (Procfile: web-async):
+#   hypercorn asgi:app -b 0.0.0.0:8000
+app = cors(Quart(__name__, static_folder="static"))
+app.json = OrjsonProvider(app)
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+log = logging.getLogger("brand-insights")
+logging.getLogger("httpx").setLevel(logging.WARNING)  # one INFO line per fetch otherwise
+
+# bulk crawl workers run the synchronous engine on their own threads, as under app.py
+jobs.start_workers()
+
+@app.after_serving
+async def close_http():
+    await aclose_fetcher()
+
+# -------- Serve the UI at root --------
+@app.route("/", methods=["GET"])
+async def serve_index():
+    return await send_from_directory(app.static_folder, "index.html")
+
+@app.route("/health", methods=["GET"])
+async def health():
+    return jsonify({"message": "Shopify Brand Insights API is live", "health": "ok"}), 200
+
+@app.route("/static/<path:path>", methods=["GET"])
+async def static_files(path):
+    return await send_from_directory(app.static_folder, path)
+
+# -------- API endpoints --------
+async def acrawl_context(website_url):
+    """context_cache.crawl_context on the event loop: one crawl per store, shared with concurrent requests and workers."""
+    async def crawl():
+        cache = AsyncPageCache()
+        ok, reason = await ais_shopify_site(website_url, cache)
+        if not ok:
+            raise NotShopifyError(reason)
+        context = await aget_brand_context(website_url, cache)
+        await asyncio.to_thread(store_context, website_url, context, cache)
+        return context
+
+    return await singleflight.arun(cache_key(website_url), crawl)
+
+async def _reply(handler, *args):
+    """Run an api.py handler off the event loop and jsonify its (payload, status)."""
+    payload, status = await asyncio.to_thread(handler, *args)
+    return jsonify(payload), status
+
+async def _ndjson(events, trace=None):
+    """api.ndjson as an async generator (the sections are already in memory)."""
+    for line in api.ndjson(events, trace):
+        yield line
+
+@app.route("/api/brand-context", methods=["POST"])
+async def brand_context():
+    """
+    Same body and payloads as app.py. With "stream": true (or ?stream=1) the
+    NDJSON lines only start once the crawl is done: the async engine fetches
+    every page before the extractors run, so there are no earlier sections.
+    """
+    try:
+        data = await request.get_json(silent=True) or {}
+        req = BrandContextRequest(**data)
+        stream = req.stream or request.args.get("stream") == "1"
+        trace = CrawlTrace() if (req.timings or request.args.get("timings") == "1") else None
+        with tracing(trace), deadlines.within(deadlines.for_request()):
+            context = await asyncio.to_thread(lookup, req.website_url)
+            if context is None:
+                context = await acrawl_context(req.website_url)
+            elif trace is not None:
+                trace.cached = True
+                trace.finish()
+        if stream:
+            return Response(_ndjson(iter_context_sections(context), trace), mimetype="application/x-ndjson")
+        return jsonify(api.with_timings(validate_context(context), trace)), 200
+    except Exception as e:
+        payload, status = api.crawl_error(e, "brand_context")
+        return jsonify(payload), status
+
+@app.route("/api/brand-context/save", methods=["POST"])
+async def brand_context_and_save():
+    try:
+        data = await request.get_json(silent=True) or {}
+        req = BrandContextRequest(**data)
+        with deadlines.within(deadlines.for_request()):
+            context = await asyncio.to_thread(lookup, req.website_url)
+            if context is None:
+                context = await acrawl_context(req.website_url)
+        return await _reply(api.saved, context)
+    except Exception as e:
+        payload, status = api.crawl_error(e, "save")
+        return jsonify(payload), status
+
+@app.route("/api/snapshots", methods=["GET"])
+async def list_snapshots():
+    return await _reply(api.list_snapshots, request.args)
+
+@app.route("/api/snapshots/<int:snapshot_id>", methods=["GET"])
+async def get_snapshot(snapshot_id):
+    return await _reply(api.get_snapshot, snapshot_id)
+
+@app.route("/api/stores/history", methods=["GET"])
+async def get_store_history():
+    return await _reply(api.get_store_history, request.args)
+
+@app.route("/api/stores/latest", methods=["GET"])
+async def get_latest_per_store():
+    return await _reply(api.get_latest_per_store, request.args)
+
+@app.route("/api/changes", methods=["GET"])
+async def list_changes():
+    return await _reply(api.list_changes, request.args)
+
+@app.route("/api/snapshots/diff", methods=["GET"])
+async def snapshot_diff():
+    return await _reply(api.snapshot_diff, request.args)
+
+@app.route("/api/jobs", methods=["POST"])
+async def create_job():
+    return await _reply(api.create_job, await request.get_json(silent=True) or {})
+
+@app.route("/api/jobs/<int:job_id>", methods=["GET"])
+async def get_job(job_id):
+    return await _reply(api.get_job, job_id)
+
+@app.route("/api/jobs/<int:job_id>/items", methods=["GET"])
+async def get_job_items(job_id):
+    return await _reply(api.get_job_items, job_id, request.args)
+
+@app.route("/api/search", methods=["GET"])
+async def search():
+    return await _reply(api.search, request.args)
+
+@app.route("/api/competitors", methods=["POST"])
+async def get_competitors():
+    # discovery is still the synchronous engine; _reply keeps it off the event loop
+    return await _reply(api.get_competitors, await request.get_json(silent=True) or {})
+
+@app.route("/metrics", methods=["GET"])
+async def metrics_endpoint():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
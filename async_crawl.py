@@ -0,0 +1,273 @@
+# async_crawl.py
+"""
+asyncio variant of the shopify_insights crawl.
+
+All network I/O is awaited on one event loop (httpx), so a single worker can
+keep hundreds of crawls in flight. Pages are prefetched into a PageCache and
+the synchronous extractors from shopify_insights then run against that warm
+cache in a worker thread, so both engines produce identical output.
+"""
+import time
+import asyncio
+import weakref
+from urllib.parse import urljoin, urlparse
+
+import httpx
+
+import deadlines
+import http_client
+import metrics
+import politeness
+from catalog import ProductCatalog
+from shopify_insights import (
+    PageCache, REQ_HEADERS, TIMEOUT, HOST_CONCURRENCY, PAGE_MAX_BYTES,
+    PRIVACY_GUESSES, REFUND_RETURN_GUESSES, FAQ_GUESS, CATALOG_MAX_PAGES, CATALOG_CONCURRENCY,
+    _norm_url, _domain, _first_link, _products_page_url, _product_record, _products_page, _PageWindow,
+    fetch_products_from_sitemap, find_policy_url, find_refund_return_urls,
+    get_brand_context, is_shopify_site,
+)
+
+# total open connections per event loop (per-host concurrency is HOST_CONCURRENCY)
+MAX_CONNECTIONS = 200
+
+_fetchers = weakref.WeakKeyDictionary()
+
+
+class AsyncFetcher:
+    """One pooled httpx client per event loop, with a semaphore per storefront host."""
+
+    def __init__(self):
+        transport = httpx.AsyncHTTPTransport(
+            retries=http_client.RETRIES,
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+        )
+        self.client = httpx.AsyncClient(
+            headers={**REQ_HEADERS, "Accept-Encoding": http_client.ACCEPT_ENCODING},
+            timeout=TIMEOUT,
+            follow_redirects=True,
+            transport=transport,
+        )
+        self._host_slots = {}
+
+    async def get(self, url, max_bytes=None):
+        """GET url; with max_bytes the body is streamed and no more than max_bytes of it is read."""
+        host = urlparse(url).netloc.lower()
+        slot = self._host_slots.setdefault(host, asyncio.Semaphore(HOST_CONCURRENCY))
+        deadlines.timeout(TIMEOUT)
+        await politeness.aacquire(url)
+        async with slot:
+            timeout = deadlines.timeout(TIMEOUT)
+            start = time.perf_counter()
+            try:
+                if max_bytes is None:
+                    r = await self.client.get(url, timeout=timeout)
+                else:
+                    r = await self._get_capped(url, timeout, max_bytes)
+            except Exception:
+                metrics.record_fetch(None, 0, 0, time.perf_counter() - start)
+                raise
+            metrics.record_fetch(r.status_code, len(r.content), 0, time.perf_counter() - start)
+        await politeness.aobserve(url, r.status_code, politeness.retry_after(r.headers))
+        return r
+
+    async def _get_capped(self, url, timeout, max_bytes):
+        # http_client._read_capped for httpx: the unread rest of the body is dropped with the connection
+        async with self.client.stream("GET", url, timeout=timeout) as r:
+            body = bytearray()
+            r.truncated = False
+            async for chunk in r.aiter_bytes(http_client.CHUNK_BYTES):
+                body += chunk
+                if len(body) > max_bytes:
+                    r.truncated = True
+                    metrics.record_truncated()
+                    break
+        r._content = bytes(body[:max_bytes])
+        return r
+
+
+def fetcher() -> AsyncFetcher:
+    loop = asyncio.get_running_loop()
+    if loop not in _fetchers:
+        _fetchers[loop] = AsyncFetcher()
+    return _fetchers[loop]
+
+
+async def aclose_fetcher():
+    f = _fetchers.pop(asyncio.get_running_loop(), None)
+    if f is not None:
+        await f.client.aclose()
+
+
+class AsyncPageCache(PageCache):
+    """
+    PageCache that can be filled with awaited fetches; concurrent awaits share
+    one request. Bodies are capped at PAGE_MAX_BYTES like the sync cache's.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._inflight = {}
+
+    async def aget(self, url):
+        key = _norm_url(url)
+        if key not in self._responses:
+            task = self._inflight.get(key)
+            if task is None:
+                task = self._inflight[key] = asyncio.ensure_future(_fetch_or_error(url, PAGE_MAX_BYTES))
+            self._responses.setdefault(key, await task)
+        r = self._responses[key]
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+    async def prefetch(self, urls):
+        await asyncio.gather(*(self.aget(u) for u in urls if u), return_exceptions=True)
+
+
+async def _fetch_or_error(url, max_bytes=None):
+    try:
+        return await fetcher().get(url, max_bytes)
+    except Exception as e:
+        return e
+
+
+# -------------------------- PRODUCTS --------------------------
+
+async def _aproducts_page(url):
+    return _products_page(await fetcher().get(url))
+
+
+async def aiter_products_json(base_url, max_pages=None, per_page=250, concurrency=None):
+    """Async twin of shopify_insights.iter_products_json (same windowing and backoff)."""
+    base = _domain(base_url)
+    max_pages = max_pages or CATALOG_MAX_PAGES
+    window = _PageWindow(concurrency or CATALOG_CONCURRENCY)
+    seen_ids, since_id = set(), None
+    page = 1
+    while page <= max_pages:
+        if since_id is not None:
+            # cursor mode: the store ignores ?page=
+            batch = [None]
+            urls = [_products_page_url(base, None, per_page, since_id)]
+        else:
+            batch = list(range(page, min(page + window.width, max_pages + 1)))
+            urls = [_products_page_url(base, n, per_page) for n in batch]
+        try:
+            results = await asyncio.gather(*(_aproducts_page(u) for u in urls))
+        except Exception:
+            return
+        for n, (status, data, retry_after) in zip(batch, results):
+            if status == 429 or status >= 500:
+                delay = window.throttled(retry_after)
+                if delay is None:
+                    return
+                await asyncio.sleep(min(delay, deadlines.remaining()))
+                page = n or page
+                break
+            if status != 200 or not data:
+                return
+            fresh = [p for p in data if p.get("id") not in seen_ids]
+            if not fresh and since_id is None:
+                since_id = last_id
+                break
+            for p in fresh:
+                last_id = p.get("id")
+                seen_ids.add(last_id)
+                yield _product_record(p, base)
+            if since_id is not None:
+                since_id = last_id
+            if len(data) < min(per_page, 250):
+                return
+        else:
+            page = (batch[-1] or page) + 1
+            window.ok()
+
+
+async def afetch_products_json(base_url, max_pages=None, per_page=250):
+    products = ProductCatalog(_domain(base_url))
+    try:
+        async for p in aiter_products_json(base_url, max_pages=max_pages, per_page=per_page):
+            products.append(p)
+    except Exception:
+        pass
+    return products
+
+
+async def _acatalog(base_url):
+    products = await afetch_products_json(base_url)
+    if not products:
+        products = await asyncio.to_thread(fetch_products_from_sitemap, base_url)
+    return products
+
+
+# -------------------------- PREFETCH --------------------------
+
+def _target_pages(base, cache):
+    """Pages the extractors will open, resolved from the (already cached) homepage and guesses."""
+    links = cache.links(base)
+    ret_urls = find_refund_return_urls(base, cache)
+    faq_url = _first_link(links, ["faq"])
+    if not faq_url:
+        guess = urljoin(_domain(base), FAQ_GUESS)
+        if cache.get(guess).status_code == 200:
+            faq_url = guess
+    return [
+        find_policy_url(base, ("privacy",), cache),
+        ret_urls.get("refund_policy_url"),
+        ret_urls.get("return_policy_url"),
+        faq_url,
+        _first_link(links, ["about"]),
+    ]
+
+
+async def _prefetch_pages(base, cache):
+    try:
+        await cache.aget(base)
+        links = await asyncio.to_thread(cache.links, base)
+    except Exception:
+        return  # the extractors report the failure exactly like the sync crawl
+
+    root, first = _domain(base), links["first"]
+    guesses = []
+    if "privacy" not in first:
+        guesses += PRIVACY_GUESSES
+    for key, label in (("refund_policy_url", "refund"), ("return_policy_url", "return")):
+        if label not in first:
+            guesses += REFUND_RETURN_GUESSES[key]
+    if "faq" not in first:
+        guesses.append(FAQ_GUESS)
+    await cache.prefetch([urljoin(root, g) for g in guesses])
+
+    await cache.prefetch(await asyncio.to_thread(_target_pages, base, cache))
+
+
+# -------------------------- PUBLIC --------------------------
+
+async def _atimed(name, coro):
+    start = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        metrics.record_stage(name, time.perf_counter() - start)
+
+async def ais_shopify_site(website_url: str, cache=None):
+    url = website_url if website_url.startswith("http") else f"https://{website_url}"
+    cache = cache if cache is not None else AsyncPageCache()
+    try:
+        await cache.aget(url)
+    except Exception as e:
+        if deadlines.expired():
+            raise deadlines.DeadlineExceeded("crawl budget exhausted during the Shopify check") from e
+        return False, str(e)
+    return await asyncio.to_thread(is_shopify_site, url, cache)
+
+
+async def aget_brand_context(website_url: str, cache=None):
+    base = website_url if website_url.startswith("http") else f"https://{website_url}"
+    cache = cache if cache is not None else AsyncPageCache()
+
+    catalog = asyncio.ensure_future(_atimed("catalog", _acatalog(base)))
+    await _atimed("prefetch", _prefetch_pages(base, cache))
+    products = await catalog
+    # everything is cached now; the shared extractors only parse
+    return await asyncio.to_thread(get_brand_context, base, cache, products)
@@ -0,0 +1,279 @@
+# bench/fixture_server.py
+"""
+Local storefront fixture for offline benchmarks.
+
+Serves synthetic Shopify-like stores, one per loopback address
+(127.0.0.1 is the seed store, 127.0.0.2.. are its "competitors"), plus a
+DuckDuckGo-style /html/ results page that links to them. Scaling knobs:
+products, anchors (extra homepage links), page_kb (filler per content page),
+latency_ms (delay per response), products_json (False forces the sitemap
+fallback). With a recording made by bench/record.py the recorded stores and
+search pages are replayed instead (see Replay).
+
+    python bench/fixture_server.py --port 8800 --products 5000 --latency-ms 20
+"""
+import re
+import sys
+import gzip
+import json
+import base64
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, quote, unquote
+
+DEFAULTS = {"products": 1000, "anchors": 300, "page_kb": 20, "latency_ms": 0, "stores": 4, "products_json": True}
+
+FILLER = "Our products are made with care and shipped worldwide. "
+
+
+class Storefront:
+    """Synthetic pages of one store; `root` is its http://host:port."""
+
+    def __init__(self, root, index, knobs):
+        self.root = root
+        self.index = index
+        self.knobs = knobs
+        self._products = None
+
+    def products(self):
+        if self._products is None:
+            offset = self.index * 10_000_000
+            self._products = [
+                {"id": offset + i + 1, "title": f"Store {self.index} product {i}", "handle": f"product-{i}",
+                 "variants": [{"price": f"{10 + i % 90}.{i % 100:02d}"}],
+                 "images": [{"src": f"https://cdn.shopify.com/s/files/{self.index}/{i}.jpg"}]}
+                for i in range(self.knobs["products"])
+            ]
+        return self._products
+
+    def filler(self):
+        return "<p>" + FILLER * max(1, self.knobs["page_kb"] * 1024 // len(FILLER)) + "</p>"
+
+    def home(self):
+        anchors = "".join(f'<a href="/collections/c{i}">Collection {i}</a>' for i in range(self.knobs["anchors"]))
+        hero = "".join(f'<a href="/products/product-{i}">Product {i}</a>' for i in range(12))
+        ld = json.dumps({"@type": "Product", "name": "Hero product", "url": f"{self.root}/products/product-0",
+                         "image": ["https://cdn.shopify.com/s/files/hero.jpg"], "offers": {"price": "19.00"}})
+        return f"""<html><head><title>Fixture Store {self.index}</title>
+<meta name="description" content="Fixture store {self.index} for benchmarks">
+<script type="application/ld+json">{ld}</script>
+<script src="https://cdn.shopify.com/s/trekkie.js"></script></head><body><main>{hero}
+<a href="/policies/privacy-policy">Privacy</a><a href="/policies/refund-policy">Refund policy</a>
+<a href="/pages/returns">Returns</a><a href="/pages/faq">FAQ</a><a href="/pages/about-us">About us</a>
+<a href="/pages/contact">Contact</a><a href="/apps/track-order">Track order</a><a href="/blogs/news">Blog</a>
+<a href="https://instagram.com/fixture{self.index}">Instagram</a><a href="https://facebook.com/fixture{self.index}">Facebook</a>
+<a href="mailto:hello@store{self.index}.test">Email</a><a href="tel:+1 555 010 {1000 + self.index}">Call</a>
+{anchors}{self.filler()}</main></body></html>"""
+
+    def faq(self):
+        pairs = "".join(f"<h3>Question {i}?</h3><p>Answer {i}. {FILLER}</p>" for i in range(20))
+        return f"<html><body><main><h1>FAQ</h1>{pairs}{self.filler()}</main></body></html>"
+
+    def page(self, title):
+        return f"<html><body><main><h1>{title}</h1>{self.filler()}</main></body></html>"
+
+    def products_json(self, query):
+        if not self.knobs["products_json"]:
+            return 404, "application/json", b'{"errors":"Not Found"}'
+        limit = min(int(query.get("limit", ["30"])[0]), 250)
+        items = self.products()
+        if "since_id" in query:
+            since = int(query["since_id"][0])
+            page = [p for p in items if p["id"] > since][:limit]
+        else:
+            n = int(query.get("page", ["1"])[0])
+            page = items[(n - 1) * limit:n * limit]
+        return 200, "application/json", json.dumps({"products": page}).encode()
+
+    def sitemap_index(self):
+        return (f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                f'<sitemap><loc>{self.root}/sitemap_products_1.xml.gz</loc><lastmod>2026-01-01</lastmod></sitemap>'
+                f'<sitemap><loc>{self.root}/sitemap_pages_1.xml</loc></sitemap></sitemapindex>')
+
+    def sitemap_products(self):
+        rows = "".join(f"<url><loc>{self.root}/products/{p['handle']}</loc><lastmod>2026-01-01</lastmod></url>"
+                       for p in self.products())
+        xml = f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{rows}</urlset>'
+        return gzip.compress(xml.encode())
+
+    def respond(self, path, query):
+        """(status, content_type, body bytes)"""
+        html = {
+            "/": self.home,
+            "/pages/faq": self.faq,
+            "/policies/privacy-policy": lambda: self.page("Privacy policy"),
+            "/policies/refund-policy": lambda: self.page("Refund policy"),
+            "/pages/returns": lambda: self.page("Returns"),
+            "/pages/about-us": lambda: self.page("About us"),
+            "/pages/contact": lambda: self.page("Contact"),
+        }
+        if path in html:
+            return 200, "text/html; charset=utf-8", html[path]().encode()
+        if path == "/products.json":
+            return self.products_json(query)
+        if path == "/sitemap.xml":
+            return 200, "application/xml", self.sitemap_index().encode()
+        if path == "/sitemap_products_1.xml.gz":
+            return 200, "application/x-gzip", self.sitemap_products()
+        if path == "/sitemap_pages_1.xml":
+            return 200, "application/xml", b'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"></urlset>'
+        return 404, "text/html", b"<html><body>Not found</body></html>"
+
+
+class Replay:
+    """
+    Responses captured by bench/record.py. Every recorded origin is served from
+    its own loopback address (the seed first, as 127.0.0.1) and links between
+    recorded origins are rewritten to match. Search result links to stores that
+    were never fetched while recording point at addresses that answer 404, so a
+    replay never leaves the machine.
+    """
+
+    def __init__(self, path, port):
+        with open(path) as f:
+            data = json.load(f)
+        self.search = data.get("search", {})
+        origins = list(data["origins"])
+        for html in self.search.values():
+            for target in re.findall(r"uddg=([^&\"'>]+)", html):
+                u = urlparse(unquote(target))
+                origin = f"{u.scheme}://{u.netloc}"
+                if u.netloc and origin not in origins:
+                    origins.append(origin)
+        self.roots = {o: f"http://127.0.0.{i + 1}:{port}" for i, o in enumerate(origins)}
+        self.responses = {self.roots[o]: pages for o, pages in data["origins"].items()}
+
+    def _rewrite(self, text):
+        for origin, root in self.roots.items():
+            host = urlparse(origin).netloc
+            for old, new in ((origin, root), (quote(origin, safe=""), quote(root, safe="")),
+                             (f"//{host}", "//" + urlparse(root).netloc)):
+                text = text.replace(old, new)
+        return text
+
+    def respond(self, root, path, query_string):
+        """(status, content_type, body) for a replayed host; None if the host is not part of the replay."""
+        if root not in self.roots.values():
+            return None
+        hit = self.responses.get(root, {}).get(path + ("?" + query_string if query_string else ""))
+        if hit is None:
+            return 404, "text/html", b"<html><body>Not recorded</body></html>"
+        if "body_b64" in hit:
+            return hit["status"], hit["content_type"], base64.b64decode(hit["body_b64"])
+        return hit["status"], hit["content_type"], self._rewrite(hit["body"]).encode()
+
+    def search_page(self, query):
+        html = self.search.get(query) or next(iter(self.search.values()), None)
+        return None if html is None else self._rewrite(html).encode()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients drop connections on purpose (streamed reads stop early); only report real errors
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+class Fixture:
+    def __init__(self, port=0, recording=None, **knobs):
+        self.knobs = {**DEFAULTS, **knobs}
+        self.server = _Server(("0.0.0.0", port), self._handler())
+        self.port = self.server.server_address[1]
+        self.replay = Replay(recording, self.port) if recording else None
+        self.stores = {}
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    def root(self, index):
+        return f"http://127.0.0.{index + 1}:{self.port}"
+
+    @property
+    def seed(self):
+        return self.root(0)
+
+    @property
+    def search_url(self):
+        return f"{self.seed}/html/"
+
+    def store(self, host):
+        with self._lock:
+            if host not in self.stores:
+                index = int(host.split(":")[0].rsplit(".", 1)[-1]) - 1
+                self.stores[host] = Storefront(f"http://{host}", index, self.knobs)
+            return self.stores[host]
+
+    def search_results(self):
+        links = "".join(
+            f'<div class="result"><a class="result__a" href="/l/?kh=-1&uddg={quote(self.root(i) + "/products/product-1", safe="")}">'
+            f"Store {i}</a></div>"
+            for i in range(1, self.knobs["stores"])
+        )
+        return f"<html><body>{links}</body></html>".encode()
+
+    def _handler(self):
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with fixture._lock:
+                    fixture.hits += 1
+                if fixture.knobs["latency_ms"]:
+                    time.sleep(fixture.knobs["latency_ms"] / 1000)
+                url = urlparse(self.path)
+                host = self.headers.get("Host") or f"127.0.0.1:{fixture.port}"
+                root = f"http://{host}"
+                out = None
+                if url.path == "/html/":
+                    q = parse_qs(url.query).get("q", [""])[0]
+                    html = fixture.replay.search_page(q) if fixture.replay is not None else None
+                    out = 200, "text/html", html if html is not None else fixture.search_results()
+                elif fixture.replay is not None:
+                    out = fixture.replay.respond(root, url.path, url.query)
+                if out is None:
+                    out = fixture.store(host).respond(url.path, parse_qs(url.query))
+                status, ctype, body = out
+                self.send_response(status)
+                if fixture.replay is None and url.path != "/html/":
+                    self.send_header("X-ShopId", str(fixture.store(host).index + 1))  # as Shopify storefronts do
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fixture-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8800)
+    ap.add_argument("--recording", help="JSON file written by bench/record.py")
+    for knob, default in DEFAULTS.items():
+        if isinstance(default, bool):
+            ap.add_argument(f"--no-{knob.replace('_', '-')}", dest=knob, action="store_false")
+        else:
+            ap.add_argument(f"--{knob.replace('_', '-')}", dest=knob, type=int, default=default)
+    args = vars(ap.parse_args())
+    fixture = Fixture(port=args.pop("port"), recording=args.pop("recording"), **args)
+    print(f"seed store {fixture.seed}  search {fixture.search_url}")
+    fixture.server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
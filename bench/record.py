@@ -0,0 +1,73 @@
+# bench/record.py
+"""
+Record a live storefront for offline replay by bench/fixture_server.py.
+
+Runs the real crawl (get_brand_context, optionally competitor_contexts) and
+captures every response the HTTP client receives: homepage, products.json
+pages, sitemaps, policy/FAQ/about pages and the DuckDuckGo result pages.
+
+    python bench/record.py https://brand.com bench/recordings/brand.json --competitors
+"""
+import os
+import sys
+import json
+import base64
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("CONTEXT_CACHE", "off")
+
+import http_client  # noqa: E402
+
+TEXT_TYPES = ("text/", "json", "xml", "javascript")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("url")
+    ap.add_argument("out")
+    ap.add_argument("--competitors", action="store_true", help="also record competitor discovery and crawls")
+    args = ap.parse_args()
+
+    seed = args.url if args.url.startswith("http") else f"https://{args.url}"
+    seed = f"{urlparse(seed).scheme}://{urlparse(seed).netloc}"
+    origins, search = {seed: {}}, {}
+    lock = threading.Lock()
+    live_get = http_client.get
+
+    def recording_get(url, headers=None, timeout=http_client.TIMEOUT, **kwargs):
+        r = live_get(url, headers=headers, timeout=timeout, **{k: v for k, v in kwargs.items() if k != "stream"})
+        u = urlparse(url)  # replayed at the requested URL, redirects already followed
+        ctype = r.headers.get("Content-Type", "")
+        entry = {"status": r.status_code, "content_type": ctype}
+        if any(t in ctype for t in TEXT_TYPES) and not u.path.endswith(".gz"):
+            entry["body"] = r.text
+        else:
+            entry["body_b64"] = base64.b64encode(r.content).decode()
+        with lock:
+            if u.netloc.endswith("duckduckgo.com"):
+                search[parse_qs(u.query).get("q", [""])[0]] = r.text
+            else:
+                origin = f"{u.scheme}://{u.netloc}"
+                origins.setdefault(origin, {})[(u.path or "/") + ("?" + u.query if u.query else "")] = entry
+        return r
+
+    http_client.get = recording_get
+
+    from shopify_insights import get_brand_context
+    get_brand_context(seed)
+    if args.competitors:
+        from competitors import competitor_contexts
+        competitor_contexts(seed)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump({"seed": seed, "origins": origins, "search": search}, f)
+    pages = sum(len(p) for p in origins.values())
+    print(f"recorded {pages} responses from {len(origins)} origins and {len(search)} search pages -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
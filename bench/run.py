@@ -0,0 +1,132 @@
+# bench/run.py
+"""
+Offline crawl benchmarks against bench/fixture_server.py.
+
+Measures end-to-end get_brand_context, competitor_contexts and
+/api/brand-context throughput/latency through the Flask app, with the
+fixture's scaling knobs. Nothing leaves the machine: the crawler talks to
+loopback stores, competitor search goes to the fixture's /html/ page, and
+the app writes to a throwaway SQLite file.
+
+Without --recording the stores are synthetic (fixture_server.py's generated
+pages and catalogs); no recorded store ships with the repo, so real-store
+numbers need a capture from bench/record.py first.
+
+    python bench/run.py --products 5000 --latency-ms 20 --repeat 5
+    python bench/run.py --recording bench/recordings/brand.json --json out.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixture_server import Fixture, DEFAULTS  # noqa: E402
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return {"runs": len(samples), "mean": round(statistics.fmean(samples), 4),
+            "p50": round(pick(0.5), 4), "p95": round(pick(0.95), 4), "max": round(samples[-1], 4)}
+
+
+def _timed(fn, repeat):
+    samples, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return _summary(samples), result
+
+
+def bench_brand_context(fixture, repeat):
+    from shopify_insights import get_brand_context
+    stats, ctx = _timed(lambda: get_brand_context(fixture.seed), repeat)
+    stats["products"] = len(ctx.get("whole_product_catalog") or [])
+    return stats
+
+
+def bench_competitors(fixture, repeat):
+    from competitors import competitor_contexts
+    stats, results = _timed(lambda: competitor_contexts(fixture.seed, limit=3), repeat)
+    stats["competitors"] = sum(1 for r in results if "context" in r)
+    return stats
+
+
+def bench_endpoint(fixture, requests_total, concurrency):
+    from app import app
+    client = app.test_client()
+
+    def call(_):
+        start = time.perf_counter()
+        r = client.post("/api/brand-context", json={"website_url": fixture.seed})
+        return time.perf_counter() - start, r.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(requests_total)))
+    elapsed = time.perf_counter() - start
+    stats = _summary([t for t, _ in results])
+    stats["concurrency"] = concurrency
+    stats["requests_per_second"] = round(requests_total / elapsed, 2)
+    stats["errors"] = sum(1 for _, status in results if status != 200)
+    return stats
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--recording", help="replay a bench/record.py capture instead of synthetic stores")
+    for knob, default in DEFAULTS.items():
+        if isinstance(default, bool):
+            ap.add_argument(f"--no-{knob.replace('_', '-')}", dest=knob, action="store_false")
+        else:
+            ap.add_argument(f"--{knob.replace('_', '-')}", dest=knob, type=int, default=default)
+    ap.add_argument("--repeat", type=int, default=3, help="runs per crawl benchmark")
+    ap.add_argument("--requests", type=int, default=20, help="endpoint requests")
+    ap.add_argument("--concurrency", type=int, default=4, help="concurrent endpoint requests")
+    ap.add_argument("--only", choices=("brand_context", "competitors", "endpoint"), action="append")
+    ap.add_argument("--json", help="also write the results to this file")
+    args = vars(ap.parse_args())
+
+    recording, out, only = args.pop("recording"), args.pop("json"), args.pop("only")
+    repeat, requests_total, concurrency = args.pop("repeat"), args.pop("requests"), args.pop("concurrency")
+    fixture = Fixture(recording=recording, **args).start()
+
+    # every run crawls: no result cache, no background jobs, a scratch database;
+    # per-host pacing is off unless POLITENESS is set, since every store here is one loopback server
+    os.environ["CONTEXT_CACHE"] = "off"
+    os.environ.setdefault("POLITENESS", "off")
+    os.environ["JOBS_WORKERS"] = "0"
+    os.environ["COMP_SEARCH_URL"] = fixture.search_url
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='bench-')}/bench.db"
+
+    results = {"knobs": {**args, "recording": recording}}
+    runs = {
+        "brand_context": lambda: bench_brand_context(fixture, repeat),
+        "competitors": lambda: bench_competitors(fixture, repeat),
+        "endpoint": lambda: bench_endpoint(fixture, requests_total, concurrency),
+    }
+    for name, run in runs.items():
+        if only and name not in only:
+            continue
+        hits = fixture.hits
+        results[name] = run()
+        results[name]["fixture_requests"] = fixture.hits - hits
+        print(f"{name:>14}: " + "  ".join(f"{k}={v}" for k, v in results[name].items()))
+    fixture.stop()
+
+    if out:
+        with open(out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# catalog.py
+"""
+Column-per-field product catalog.
+
+A store with 10k+ products used to be held as one dict per product, then a
+pydantic model per product, then a dict again. ProductCatalog keeps one list
+per field instead (product URLs are rebuilt from the store root and handle
+rather than stored), yields plain product dicts on iteration and slicing so
+existing consumers keep working, and serializes straight to JSON in chunks.
+"""
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+# rows materialized at a time while serializing or validating
+CHUNK = 1000
+
+_NO_URL = ""  # url column marker: record explicitly had no URL
+
+
+class ProductCatalog:
+    __slots__ = ("base", "ids", "titles", "handles", "prices", "urls", "images")
+
+    def __init__(self, base=None):
+        self.base = base
+        self.ids, self.titles, self.handles, self.prices, self.urls, self.images = [], [], [], [], [], []
+
+    @classmethod
+    def from_records(cls, records, base=None):
+        if isinstance(records, cls):
+            return records
+        catalog = cls(base)
+        catalog.extend(records)
+        return catalog
+
+    def _derived_url(self, handle):
+        return f"{self.base}/products/{handle}" if (self.base and handle) else None
+
+    def append(self, p: dict):
+        handle, url = p.get("handle"), p.get("url")
+        self.ids.append(p.get("id"))
+        self.titles.append(p.get("title"))
+        self.handles.append(handle)
+        self.prices.append(p.get("price"))
+        if url is None:
+            self.urls.append(_NO_URL if handle else None)
+        else:
+            url = str(url)
+            if self.base is None and handle and url.endswith(f"/products/{handle}"):
+                self.base = url[:-len(f"/products/{handle}")]  # first product URL reveals the store root
+            self.urls.append(None if url == self._derived_url(handle) else url)
+        self.images.append(p.get("image"))
+
+    def extend(self, records):
+        if isinstance(records, ProductCatalog) and records.base == self.base:
+            for name in ("ids", "titles", "handles", "prices", "urls", "images"):
+                getattr(self, name).extend(getattr(records, name))
+            return
+        for p in records:
+            self.append(p)
+
+    def row(self, i: int) -> dict:
+        handle, url = self.handles[i], self.urls[i]
+        if url is None:
+            url = self._derived_url(handle)
+        elif url == _NO_URL:
+            url = None
+        return {"id": self.ids[i], "title": self.titles[i], "handle": handle,
+                "price": self.prices[i], "url": url, "image": self.images[i]}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for i in range(len(self.ids)):
+            yield self.row(i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.row(i) for i in range(*index.indices(len(self.ids)))]
+        return self.row(range(len(self.ids))[index])
+
+    def __repr__(self):
+        return f"ProductCatalog({len(self)} products, base={self.base!r})"
+
+    def to_json(self) -> bytes:
+        """JSON array of the product dicts (sorted keys), built CHUNK rows at a time."""
+        parts = []
+        for start in range(0, len(self), CHUNK):
+            parts.append(orjson.dumps(self[start:start + CHUNK], option=orjson.OPT_SORT_KEYS)[1:-1])
+        return b"[" + b",".join(p for p in parts if p) + b"]"
+
+
+def json_default(obj):
+    """orjson `default` hook: embeds a ProductCatalog as pre-serialized JSON."""
+    if isinstance(obj, ProductCatalog):
+        return orjson.Fragment(obj.to_json())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask/Quart JSON provider backed by orjson. Output matches the default
+    provider (sorted keys, RFC 822 dates) and ProductCatalog serializes
+    without materializing the whole catalog.
+    """
+
+    @staticmethod
+    def _default(obj):
+        if isinstance(obj, ProductCatalog):
+            return orjson.Fragment(obj.to_json())
+        return DefaultJSONProvider.default(obj)
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self._default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
@@ -1,23 +1,35 @@
 # competitors.py
 import os
 import re
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from urllib.parse import urlparse, urlencode, parse_qs, unquote
-import requests
 from bs4 import BeautifulSoup
 
-from shopify_insights import get_brand_context, is_shopify_site  # same-folder import
+import http_client
+from deadlines import DeadlineExceeded
+from shopify_insights import is_shopify_site  # same-folder import
+from context_cache import NotShopifyError, crawl_context, lookup
 
 UA = {"User-Agent": "Mozilla/5.0 (BrandInsightsBot/1.1)"}
 TIMEOUT = 15
+# DuckDuckGo HTML endpoint; point it at a local fixture (see bench/) for offline runs
+SEARCH_URL = os.getenv("COMP_SEARCH_URL", "https://duckduckgo.com/html/")
 # Enable verbose logs by running in the server terminal:  export COMP_DEBUG=1
 DEBUG = os.getenv("COMP_DEBUG", "0") == "1"
+# candidates verified at once, and competitor stores crawled at once
+VERIFY_WORKERS = int(os.getenv("COMP_VERIFY_WORKERS", "8"))
+CRAWL_WORKERS = int(os.getenv("COMP_CRAWL_WORKERS", "3"))
 
 
 # -------------------------- logging helper --------------------------
 
+log = logging.getLogger("competitors")
+
 def _log(*args):
-    if DEBUG:
-        print("[competitors]", *args)
+    # always logged at DEBUG; COMP_DEBUG=1 lifts it to INFO so it shows with the app's logging config
+    log.log(logging.INFO if DEBUG else logging.DEBUG, " ".join(str(a) for a in args))
 
 
 # -------------------------- small utils --------------------------
@@ -127,6 +139,7 @@ def _promote_storeish_links(hrefs):
 def _ddg_search_pages(seed_root: str):
     """
     Yield HTML result pages for different query phrasings to improve recall.
+    All queries are fetched at once; pages are yielded in query order.
     """
     queries = [
         f"Shopify brands similar to {seed_root}",
@@ -134,27 +147,48 @@ def _ddg_search_pages(seed_root: str):
         f"{seed_root} competitors Shopify",
         f"site:.myshopify.com brands similar to {seed_root}",  # extra hint
     ]
-    for q in queries:
-        url = f"https://duckduckgo.com/html/?{urlencode({'q': q})}"
+
+    def fetch(q):
+        url = f"{SEARCH_URL}?{urlencode({'q': q})}"
         _log("query:", q)
         try:
-            r = requests.get(url, headers=UA, timeout=TIMEOUT)
+            r = http_client.get(url, headers=UA, timeout=TIMEOUT)
             r.raise_for_status()
-            yield r.text
+            return r.text
         except Exception as e:
             _log("ddg fetch failed:", e)
-            continue
+            return None
+
+    pool = ThreadPoolExecutor(max_workers=len(queries))
+    try:
+        futures = [pool.submit(contextvars.copy_context().run, fetch, q) for q in queries]
+        for html in (f.result() for f in futures):
+            if html is not None:
+                yield html
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
 
 
 # -------------------------- discovery --------------------------
 
-def discover_competitors(seed_url: str, max_items: int = 3, loose: bool = False):
+def _verify(root):
+    # no page cache: most candidates are never crawled, so the check streams only
+    # as much of the homepage as it needs; a confirmed competitor's crawl fetches it again
+    try:
+        return is_shopify_site(root)
+    except DeadlineExceeded as e:
+        return False, str(e)
+
+def discover_competitors(seed_url: str, max_items: int = 3, loose: bool = False, verdicts=None):
     """
     Best-effort competitor discovery via DuckDuckGo.
-    - Parse links from multiple queries
+    - Parse links from multiple queries (fetched concurrently)
     - Normalize to roots, filter obvious non-store 'noise'
-    - STRICT: return only Shopify-like roots (via is_shopify_site)
+    - STRICT: return only Shopify-like roots (via is_shopify_site, verified in parallel)
     - LOOSE: return top non-noise roots if strict found nothing
+    Candidates keep discovery order; verification stops as soon as the first
+    `max_items` Shopify-like candidates in that order are known.
+    `verdicts`, if given, is filled with root -> (ok, reason).
     """
     seed_root = _normalize_root(seed_url)
     if not seed_root:
@@ -162,40 +196,66 @@ def discover_competitors(seed_url: str, max_items: int = 3, loose: bool = False)
         return []
 
     _log("seed root:", seed_root)
-    strict, loose_pool, seen = [], [], set()
-
-    for html in _ddg_search_pages(seed_root):
-        hrefs = _extract_result_links(html)
-        _log("raw extracted:", hrefs[:10])
-        hrefs = _promote_storeish_links(hrefs)
-
-        for href in hrefs:
-            root = _normalize_root(href)
-            if not root:
-                _log("skip invalid root:", href)
-                continue
-            if root == seed_root:
-                _log("skip same as seed:", root)
-                continue
-            if root in seen:
-                _log("skip already seen:", root)
-                continue
-            if _is_noise_domain(root):
-                _log("skip noise domain:", root)
-                continue
-
-            seen.add(root)
-
-            ok, why = is_shopify_site(root)
-            _log("candidate:", root, "| shopify_like:", ok, "| reason:", why)
-
-            if ok:
+    verdicts = verdicts if verdicts is not None else {}
+    candidates, futures = [], {}
+
+    def settled():
+        """STRICT list once its first max_items entries are decided, else None."""
+        strict = []
+        for root in candidates:
+            f = futures[root]
+            if not f.done():
+                return None
+            if root not in verdicts:
+                verdicts[root] = f.result()
+                _log("candidate:", root, "| shopify_like:", verdicts[root][0], "| reason:", verdicts[root][1])
+            if verdicts[root][0]:
                 strict.append(root)
                 if len(strict) >= max_items:
                     _log("STRICT reached limit:", strict)
                     return strict
-            else:
-                loose_pool.append(root)
+        return None
+
+    pool = ThreadPoolExecutor(max_workers=VERIFY_WORKERS)
+    try:
+        for html in _ddg_search_pages(seed_root):
+            hrefs = _extract_result_links(html)
+            _log("raw extracted:", hrefs[:10])
+            hrefs = _promote_storeish_links(hrefs)
+
+            for href in hrefs:
+                root = _normalize_root(href)
+                if not root:
+                    _log("skip invalid root:", href)
+                    continue
+                if root == seed_root:
+                    _log("skip same as seed:", root)
+                    continue
+                if root in futures:
+                    _log("skip already seen:", root)
+                    continue
+                if _is_noise_domain(root):
+                    _log("skip noise domain:", root)
+                    continue
+
+                candidates.append(root)
+                futures[root] = pool.submit(contextvars.copy_context().run, _verify, root)
+
+            strict = settled()
+            if strict:
+                return strict
+
+        pending = set(futures.values())
+        while pending:
+            _, pending = wait(pending, return_when=FIRST_COMPLETED)
+            strict = settled()
+            if strict:
+                return strict
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    strict = [r for r in candidates if verdicts[r][0]]
+    loose_pool = [r for r in candidates if not verdicts[r][0]]
 
     if strict:
         _log("returning STRICT:", strict)
@@ -214,23 +274,31 @@ def discover_competitors(seed_url: str, max_items: int = 3, loose: bool = False)
 
 def competitor_contexts(seed_url: str, limit: int = 3, loose: bool = False):
     """
-    Return contexts for discovered competitors.
-    - In strict mode: double-check Shopify-ness before scraping.
+    Return contexts for discovered competitors, crawled concurrently.
+    - In strict mode: only Shopify-like roots are scraped (verdicts from discovery are reused).
     - In loose mode: scrape best-effort roots (some may fail).
     """
-    results = []
-    roots = discover_competitors(seed_url, max_items=limit, loose=loose)
+    verdicts = {}
+    roots = discover_competitors(seed_url, max_items=limit, loose=loose, verdicts=verdicts)
     _log("final roots:", roots)
 
-    for domain in roots:
+    def crawl(domain):
         try:
-            if not loose:
-                ok, _ = is_shopify_site(domain)
-                if not ok:
-                    results.append({"competitor": domain, "error": "not Shopify-like"})
-                    continue
-            ctx = get_brand_context(domain)
-            results.append({"competitor": domain, "context": ctx})
+            ctx = lookup(domain)
+            if ctx is not None:
+                return {"competitor": domain, "context": ctx}
+            verdict = verdicts.get(domain)
+            if verdict and not verdict[0] and not loose:
+                return {"competitor": domain, "error": "not Shopify-like"}
+            # shared with any concurrent crawl of the same store (another request's seed or competitor)
+            ctx = crawl_context(domain, check=not loose and not verdict)
+            return {"competitor": domain, "context": ctx}
+        except NotShopifyError:
+            return {"competitor": domain, "error": "not Shopify-like"}
         except Exception as e:
-            results.append({"competitor": domain, "error": str(e)})
-    return results
\ No newline at end of file
+            return {"competitor": domain, "error": str(e)}
+
+    # each crawl inherits the caller's deadline (and trace)
+    with ThreadPoolExecutor(max_workers=max(1, min(CRAWL_WORKERS, len(roots)))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, crawl, domain) for domain in roots]
+        return [f.result() for f in futures]
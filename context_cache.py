@@ -0,0 +1,275 @@
+# context_cache.py
+"""
+Brand-context result cache keyed by the _domain()-normalized store URL.
+
+Entries younger than CONTEXT_CACHE_TTL are served as-is. Stale entries are
+revalidated with conditional GETs (If-None-Match / If-Modified-Since) against
+the homepage and the first products.json page; if every validator answers 304
+the entry is refreshed without recrawling. Those two miss changes further down
+the catalog and on policy, FAQ and about pages, so 304s only keep an entry
+until CONTEXT_CACHE_MAX_AGE after its crawl. Backends (CONTEXT_CACHE):
+  memory - in-process LRU (default)
+  db     - brand_context_cache table on the db.py engine, shared by workers
+  off    - no caching
+Misses are crawled through crawl_context(), which shares one crawl between
+every concurrent request for the same store (see singleflight.py).
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import orjson
+from sqlalchemy import text
+
+import http_client
+import metrics
+import singleflight
+from catalog import json_default
+from shopify_insights import REQ_HEADERS, TIMEOUT, _domain, collect_context, get_brand_context, is_shopify_site, PageCache
+
+BACKEND = os.getenv("CONTEXT_CACHE", "memory")
+TTL = float(os.getenv("CONTEXT_CACHE_TTL", "900"))
+MAX_AGE = float(os.getenv("CONTEXT_CACHE_MAX_AGE", "21600"))
+MAX_ENTRIES = int(os.getenv("CONTEXT_CACHE_SIZE", "256"))
+
+log = logging.getLogger(__name__)
+
+
+def cache_key(url: str) -> str:
+    return _domain(url).lower()
+
+
+class NotShopifyError(ValueError):
+    """The store failed is_shopify_site; str() is the API's error message."""
+
+    def __init__(self, reason):
+        super().__init__(f"website not reachable or not Shopify-like: {reason}")
+        self.reason = reason
+
+
+# -------------------------- backends --------------------------
+
+class MemoryStore:
+    """Thread-safe LRU of {"context", "validators", "stored_at", "crawled_at"} entries."""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def touch(self, key, stored_at):
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] = {**self._entries[key], "stored_at": stored_at}
+
+
+class SqlStore:
+    """Same interface backed by the brand_context_cache table (see db.get_engine)."""
+
+    def __init__(self, engine, max_entries=MAX_ENTRIES):
+        self.engine = engine
+        self.max_entries = max_entries
+
+    def get(self, key):
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                text("SELECT context_json, validators_json, stored_at, crawled_at FROM brand_context_cache WHERE store_key = :k"),
+                {"k": key}
+            ).first()
+            if row is None:
+                return None
+            conn.execute(text("UPDATE brand_context_cache SET accessed_at = :t WHERE store_key = :k"), {"t": time.time(), "k": key})
+        return {"context": orjson.loads(row[0]), "validators": orjson.loads(row[1]), "stored_at": row[2], "crawled_at": row[3]}
+
+    def put(self, key, entry):
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM brand_context_cache WHERE store_key = :k"), {"k": key})
+            conn.execute(
+                text("INSERT INTO brand_context_cache (store_key, context_json, validators_json, stored_at, accessed_at, crawled_at) "
+                     "VALUES (:k, :c, :v, :s, :a, :cr)"),
+                {"k": key, "c": orjson.dumps(entry["context"], default=json_default), "v": orjson.dumps(entry["validators"]),
+                 "s": entry["stored_at"], "a": now, "cr": entry["crawled_at"]}
+            )
+            # LRU eviction: drop everything older than the max_entries-th most recently used row
+            cutoff = conn.execute(
+                text("SELECT accessed_at FROM brand_context_cache ORDER BY accessed_at DESC LIMIT 1 OFFSET :n"),
+                {"n": self.max_entries}
+            ).scalar()
+            if cutoff is not None:
+                conn.execute(text("DELETE FROM brand_context_cache WHERE accessed_at <= :c"), {"c": cutoff})
+
+    def touch(self, key, stored_at):
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("UPDATE brand_context_cache SET stored_at = :s, accessed_at = :s WHERE store_key = :k"),
+                {"s": stored_at, "k": key}
+            )
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """The configured backend, or None when caching is off."""
+    global _store
+    if _store is None and BACKEND != "off":
+        with _store_lock:
+            if _store is None:
+                if BACKEND == "db":
+                    from db import ENGINE
+                    _store = SqlStore(ENGINE)
+                else:
+                    _store = MemoryStore()
+    return _store
+
+
+def set_store(store):
+    """Plug in another backend (anything with get/put/touch)."""
+    global _store
+    _store = store
+
+
+# -------------------------- validators --------------------------
+
+def _validator(r):
+    v = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+    return v if (v["etag"] or v["last_modified"]) else None
+
+
+def _collect_validators(website_url, page_cache=None):
+    key = cache_key(website_url)
+    validators = {}
+    home = key + "/"
+    products = f"{key}/products.json?limit=1"
+    for url in (home, products):
+        try:
+            if url == home and page_cache is not None:
+                r = page_cache.get(home)  # already fetched when the crawl started at the root
+            else:
+                r = http_client.get(url, headers=REQ_HEADERS, timeout=TIMEOUT)
+            v = _validator(r) if r.status_code == 200 else None
+        except Exception:
+            v = None
+        if v:
+            validators[url] = v
+    return validators
+
+
+def _revalidate(validators):
+    """True only if every recorded validator is answered with 304 Not Modified."""
+    if not validators:
+        return False
+    for url, v in validators.items():
+        headers = dict(REQ_HEADERS)
+        if v.get("etag"):
+            headers["If-None-Match"] = v["etag"]
+        if v.get("last_modified"):
+            headers["If-Modified-Since"] = v["last_modified"]
+        try:
+            r = http_client.get(url, headers=headers, timeout=TIMEOUT)
+        except Exception:
+            return False
+        if r.status_code != 304:
+            return False
+    return True
+
+
+# -------------------------- public --------------------------
+
+def lookup(website_url: str):
+    """Cached context for the store (revalidating a stale entry), or None on a miss."""
+    store = get_store()
+    if store is None:
+        return None
+    key = cache_key(website_url)
+    try:
+        entry = store.get(key)
+        if entry is None:
+            return None
+        now = time.time()
+        if now - entry["stored_at"] <= TTL:
+            return entry["context"]
+        # entries from before crawled_at existed count as too old to revalidate
+        if now - (entry.get("crawled_at") or 0) <= MAX_AGE and _revalidate(entry["validators"]):
+            store.touch(key, time.time())
+            return entry["context"]
+    except Exception:
+        # a broken backend must not fail the request, but it turns every lookup into a crawl
+        log.warning("context cache lookup failed for %s", key, exc_info=True)
+        metrics.record_cache_error("lookup")
+    return None
+
+
+def store_context(website_url: str, context: dict, page_cache=None):
+    store = get_store()
+    # a crawl cut short by its deadline is served once, not cached
+    if store is None or context.get("partial"):
+        return
+    try:
+        now = time.time()
+        entry = {
+            "context": context,
+            "validators": _collect_validators(website_url, page_cache),
+            "stored_at": now,
+            "crawled_at": now,
+        }
+        store.put(cache_key(website_url), entry)
+    except Exception:
+        log.warning("context cache store failed for %s", website_url, exc_info=True)
+        metrics.record_cache_error("store")
+
+
+def crawl_context(website_url: str, page_cache=None, check=True):
+    """
+    Crawl the store and cache its context; concurrent calls for the same
+    store share one crawl. With `check`, a site that fails is_shopify_site
+    raises NotShopifyError (for every caller sharing the crawl).
+    """
+    def crawl():
+        cache = page_cache if page_cache is not None else PageCache()
+        if check:
+            ok, reason = is_shopify_site(website_url, cache)
+            if not ok:
+                raise NotShopifyError(reason)
+        context = get_brand_context(website_url, cache)
+        store_context(website_url, context, cache)
+        return context
+
+    return singleflight.run(cache_key(website_url), crawl)
+
+
+def remember(website_url: str, events, page_cache=None, flight=None):
+    """
+    Pass iter_brand_context events through and cache the assembled context
+    once the stream ends; `flight` (a leading singleflight.Flight) is
+    finished with it, or given up if the stream stops early.
+    """
+    seen = []
+    context = singleflight.MISSING
+    try:
+        for event in events:
+            seen.append(event)
+            yield event
+        context = collect_context(seen)
+        store_context(website_url, context, page_cache)
+    finally:
+        if flight is not None:
+            flight.finish(context)
@@ -1,37 +1,399 @@
-import os, datetime, orjson
-from sqlalchemy import create_engine, text
+import os, re, datetime, hashlib, logging, orjson
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.engine import Engine
 from dotenv import load_dotenv
 
+from catalog import json_default
+
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 def db_url() -> str:
     # Use MySQL if provided, else SQLite file
     return os.getenv("DATABASE_URL", "sqlite:///data.db")
 
+def _create_index(conn, name: str, table: str, columns: str, kind: str = ""):
+    """CREATE [kind] INDEX unless it exists (MySQL has no CREATE INDEX IF NOT EXISTS)."""
+    create = f"CREATE {kind} INDEX" if kind else "CREATE INDEX"
+    if conn.dialect.name == "sqlite":
+        conn.execute(text(f"{create} IF NOT EXISTS {name} ON {table} ({columns})"))
+    elif name not in {i["name"] for i in inspect(conn).get_indexes(table)}:
+        conn.execute(text(f"{create} {name} ON {table} ({columns})"))
+
 def get_engine() -> Engine:
     eng = create_engine(db_url(), future=True)
+    # MySQL spells auto-increment keys differently, caps BLOB at 64 KB, keeps TIMESTAMP
+    # to whole seconds and reserves the word CHANGE; SQLite takes the rest as-is
+    mysql = eng.dialect.name == "mysql"
+    serial = "BIGINT AUTO_INCREMENT PRIMARY KEY" if mysql else "INTEGER PRIMARY KEY AUTOINCREMENT"
+    blob = "LONGBLOB" if mysql else "BLOB"
+    stamp = "DATETIME(6)" if mysql else "TIMESTAMP"
+    change = eng.dialect.identifier_preparer.quote("change")
     with eng.begin() as conn:
-        conn.execute(text("""
+        conn.execute(text(f"""
         CREATE TABLE IF NOT EXISTS brand_snapshots (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id {serial},
+            store_url VARCHAR(255) NOT NULL,
+            snapshot_json {blob} NOT NULL,
+            created_at {stamp} NOT NULL
+        )
+        """))
+        # per-store history / latest-per-store and time-range scans
+        _create_index(conn, "ix_brand_snapshots_store", "brand_snapshots", "store_url, id")
+        _create_index(conn, "ix_brand_snapshots_created", "brand_snapshots", "created_at, id")
+        # brand contexts cached by context_cache's "db" backend, one row per store
+        conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS brand_context_cache (
+            store_key VARCHAR(255) PRIMARY KEY,
+            context_json {blob} NOT NULL,
+            validators_json {blob} NOT NULL,
+            stored_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            crawled_at REAL
+        )
+        """))
+        # crawled_at came later: tables created before it get the column here
+        if "crawled_at" not in {c["name"] for c in inspect(conn).get_columns("brand_context_cache")}:
+            conn.execute(text("ALTER TABLE brand_context_cache ADD COLUMN crawled_at REAL"))
+        # single-flight crawls (see singleflight.py): one row per store being crawled
+        conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS crawl_flights (
+            store_key VARCHAR(255) PRIMARY KEY,
+            owner VARCHAR(64) NOT NULL,
+            status VARCHAR(16) NOT NULL,
+            waiters INTEGER NOT NULL DEFAULT 0,
+            result_json {blob},
+            expires_at REAL NOT NULL
+        )
+        """))
+        # content-addressed snapshot parts: brand_snapshots rows only reference these by hash
+        conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS snapshot_sections (
+            hash VARCHAR(64) PRIMARY KEY,
+            section VARCHAR(64) NOT NULL,
+            body {blob} NOT NULL
+        )
+        """))
+        conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS snapshot_products (
+            hash VARCHAR(32) PRIMARY KEY,
+            product_id BIGINT,
+            handle TEXT,
+            title TEXT,
+            price TEXT,
+            body {blob} NOT NULL
+        )
+        """))
+        # catalog change tracking: the catalog each snapshot saved, and the product-level
+        # differences from the store's previous catalog, written as snapshots are saved
+        conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS snapshot_catalogs (
+            snapshot_id INTEGER PRIMARY KEY,
+            store_url VARCHAR(255) NOT NULL,
+            catalog_hash VARCHAR(64) NOT NULL
+        )
+        """))
+        _create_index(conn, "ix_snapshot_catalogs_store", "snapshot_catalogs", "store_url, snapshot_id")
+        conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS product_changes (
+            id {serial},
+            store_url VARCHAR(255) NOT NULL,
+            snapshot_id BIGINT NOT NULL,
+            prev_snapshot_id BIGINT NOT NULL,
+            product_key VARCHAR(255) NOT NULL,
+            product_id BIGINT,
+            handle TEXT,
+            title TEXT,
+            {change} VARCHAR(16) NOT NULL,
+            old_price TEXT,
+            new_price TEXT,
+            created_at {stamp} NOT NULL
+        )
+        """))
+        _create_index(conn, "ix_product_changes_created", "product_changes", "created_at, id")
+        _create_index(conn, "ix_product_changes_store", "product_changes", "store_url, created_at, id")
+        _create_index(conn, "ix_product_changes_snapshot", "product_changes", "snapshot_id, id")
+        # bulk crawl queue (see jobs.py): one job row, one item row per store URL
+        conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS crawl_jobs (
+            id {serial},
+            total INTEGER NOT NULL,
+            created_at {stamp} NOT NULL
+        )
+        """))
+        conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS crawl_job_items (
+            id {serial},
+            job_id BIGINT NOT NULL,
             store_url TEXT NOT NULL,
-            snapshot_json BLOB NOT NULL,
-            created_at TIMESTAMP NOT NULL
+            host VARCHAR(255) NOT NULL,
+            status VARCHAR(16) NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker VARCHAR(64),
+            claimed_at REAL,
+            snapshot_id BIGINT,
+            error TEXT,
+            finished_at {stamp}
         )
         """))
+        _create_index(conn, "ix_crawl_job_items_status", "crawl_job_items", "status, id")
+        _create_index(conn, "ix_crawl_job_items_job", "crawl_job_items", "job_id, id")
+        _create_search_tables(conn, serial)
     return eng
 
+def _create_search_tables(conn, serial: str):
+    """search_documents plus its full-text index: FTS5 on SQLite, FULLTEXT on MySQL (see search_snapshots)."""
+    conn.execute(text(f"""
+    CREATE TABLE IF NOT EXISTS search_documents (
+        id {serial},
+        store_url VARCHAR(255) NOT NULL,
+        snapshot_id BIGINT NOT NULL,
+        kind VARCHAR(32) NOT NULL,
+        ref TEXT,
+        title TEXT,
+        body TEXT
+    )
+    """))
+    _create_index(conn, "ix_search_documents_store", "search_documents", "store_url")
+    if conn.dialect.name == "mysql":
+        _create_index(conn, "ft_search_documents", "search_documents", "title, body", kind="FULLTEXT")
+        return
+    if conn.dialect.name != "sqlite":
+        return  # no native index: search_snapshots falls back to LIKE
+    try:
+        # external-content index over search_documents, kept in step by triggers
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(title, body, "
+            "content='search_documents', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN "
+            "INSERT INTO search_fts (rowid, title, body) VALUES (new.id, new.title, new.body); END"
+        ))
+        conn.execute(text(
+            "CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN "
+            "INSERT INTO search_fts (search_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); END"
+        ))
+    except OperationalError:
+        log.warning("SQLite was built without FTS5; /api/search falls back to LIKE scans")
+
 ENGINE = get_engine()
+# product_changes.change, quoted where the dialect reserves the word
+CHANGE = ENGINE.dialect.identifier_preparer.quote("change")
+
+# Snapshot storage: every section of a payload is stored once per distinct content
+# (snapshot_sections), every product once per distinct content (snapshot_products),
+# and the catalog as an ordered list of product digests. A brand_snapshots row only
+# holds the small manifest {"__sections__": {section: hash}, "__keys__": [...]};
+# rows written before this layout still hold the full payload and load as-is.
+POLICY_KEYS = (
+    "privacy_policy_url", "privacy_policy_excerpt",
+    "refund_policy_url", "refund_policy_excerpt",
+    "return_policy_url", "return_policy_excerpt",
+)
+CATALOG = "whole_product_catalog"
+CATALOG_MANIFEST = "catalog_manifest"  # snapshot_sections.section of digest-list bodies
+DIGEST_SIZE = 16
+CHUNK = 500
+
+def _digest(body: bytes) -> bytes:
+    return hashlib.blake2b(body, digest_size=DIGEST_SIZE).digest()
+
+def _dumps(value) -> bytes:
+    return orjson.dumps(value, default=json_default, option=orjson.OPT_SORT_KEYS)
+
+def _split_sections(payload: dict) -> dict:
+    """Group payload keys into stored sections (the six policy fields travel together)."""
+    sections = {}
+    for key, value in payload.items():
+        if key in POLICY_KEYS:
+            sections.setdefault("policies", {})[key] = value
+        else:
+            sections[key] = value
+    return sections
+
+def _existing(conn, table: str, hashes):
+    found = set()
+    hashes = list(hashes)
+    for i in range(0, len(hashes), CHUNK):
+        chunk = hashes[i:i + CHUNK]
+        params = {f"h{n}": h for n, h in enumerate(chunk)}
+        marks = ", ".join(f":{k}" for k in params)
+        found.update(conn.execute(text(f"SELECT hash FROM {table} WHERE hash IN ({marks})"), params).scalars())
+    return found
+
+def _insert_new(conn, table: str, columns: str, values: str):
+    """INSERT that skips rows whose hash is already stored: concurrent saves may write the same content."""
+    if conn.dialect.name == "mysql":
+        return text(f"INSERT IGNORE INTO {table} ({columns}) VALUES ({values})")
+    return text(f"INSERT INTO {table} ({columns}) VALUES ({values}) ON CONFLICT (hash) DO NOTHING")
+
+def _put_section(conn, section: str, body: bytes) -> str:
+    h = _digest(body).hex()
+    if not _existing(conn, "snapshot_sections", [h]):
+        conn.execute(_insert_new(conn, "snapshot_sections", "hash, section, body", ":h, :s, :b"),
+                     {"h": h, "s": section, "b": body})
+    return h
+
+def _put_catalog(conn, products) -> str:
+    bodies = [_dumps(p) for p in products]
+    digests = [_digest(b) for b in bodies]
+    manifest = b"".join(digests)
+    h = _digest(manifest).hex()
+    if _existing(conn, "snapshot_sections", [h]):
+        return h  # identical catalog already stored: nothing to write
+    rows = {d.hex(): (p, b) for d, p, b in zip(digests, products, bodies)}
+    missing = set(rows) - _existing(conn, "snapshot_products", rows)
+    if missing:
+        conn.execute(
+            _insert_new(conn, "snapshot_products", "hash, product_id, handle, title, price, body",
+                        ":h, :i, :hd, :t, :p, :b"),
+            [{"h": k, "i": rows[k][0].get("id"), "hd": rows[k][0].get("handle"), "t": rows[k][0].get("title"),
+              "p": rows[k][0].get("price"), "b": rows[k][1]} for k in missing]
+        )
+    conn.execute(_insert_new(conn, "snapshot_sections", "hash, section, body", ":h, :s, :b"),
+                 {"h": h, "s": CATALOG_MANIFEST, "b": manifest})
+    return h
 
 def save_snapshot(store_url: str, payload: dict) -> int:
-    blob = orjson.dumps(payload)
+    now = datetime.datetime.utcnow()
     with ENGINE.begin() as conn:
+        refs = {}
+        for section, value in _split_sections(payload).items():
+            if section == CATALOG and value:
+                refs[section] = _put_catalog(conn, value)
+            else:
+                refs[section] = _put_section(conn, section, _dumps(value))
+        blob = orjson.dumps({"__sections__": refs, "__keys__": list(payload)})
         res = conn.execute(
             text("INSERT INTO brand_snapshots (store_url, snapshot_json, created_at) VALUES (:u, :j, :t)"),
-            {"u": store_url, "j": blob, "t": datetime.datetime.utcnow()}
+            {"u": store_url, "j": blob, "t": now}
+        )
+        snapshot_id = int(res.lastrowid)
+        if payload.get("partial"):
+            # cut short by the crawl budget: a truncated catalog and default sections would
+            # read as removed products and wipe the store's search documents
+            return snapshot_id
+        if payload.get(CATALOG):
+            _record_changes(conn, store_url, snapshot_id, refs[CATALOG], payload[CATALOG], now)
+        _index_snapshot(conn, store_url, snapshot_id, payload)
+        return snapshot_id
+
+# ---------- catalog change tracking ----------
+# Products are matched across snapshots by id (handle when a record has no id).
+# Snapshots with an empty catalog (failed catalog crawl) are not diffed, so a
+# transient failure never reads as "everything removed".
+
+def _product_key(p) -> str:
+    return str(p["id"]) if p.get("id") is not None else f"handle:{p.get('handle')}"
+
+def _catalog_index(products) -> dict:
+    """{product_key: {"product_id", "handle", "title", "price"}} for a list of product records."""
+    return {
+        _product_key(p): {"product_id": p.get("id"), "handle": p.get("handle"),
+                          "title": p.get("title"), "price": p.get("price")}
+        for p in products
+    }
+
+def _stored_catalog_index(conn, catalog_hash: str) -> dict:
+    """_catalog_index of a stored catalog, read from the snapshot_products columns (bodies stay unparsed)."""
+    manifest = conn.execute(text("SELECT body FROM snapshot_sections WHERE hash = :h"), {"h": catalog_hash}).scalar()
+    hashes = list(dict.fromkeys(manifest[i:i + DIGEST_SIZE].hex() for i in range(0, len(manifest), DIGEST_SIZE)))
+    products = []
+    for i in range(0, len(hashes), CHUNK):
+        chunk = hashes[i:i + CHUNK]
+        params = {f"h{n}": h for n, h in enumerate(chunk)}
+        marks = ", ".join(f":{k}" for k in params)
+        products += conn.execute(
+            text(f"SELECT product_id AS id, handle, title, price FROM snapshot_products WHERE hash IN ({marks})"), params
+        ).mappings().all()
+    return _catalog_index(products)
+
+def diff_catalogs(old: dict, new: dict):
+    """Added, removed and repriced products between two _catalog_index results."""
+    changes = []
+    for key, p in new.items():
+        before = old.get(key)
+        if before is None:
+            changes.append({"product_key": key, **p, "change": "added", "old_price": None, "new_price": p["price"]})
+        elif before["price"] != p["price"]:
+            changes.append({"product_key": key, **p, "change": "repriced",
+                            "old_price": before["price"], "new_price": p["price"]})
+    for key, p in old.items():
+        if key not in new:
+            changes.append({"product_key": key, **p, "change": "removed", "old_price": p["price"], "new_price": None})
+    for c in changes:
+        del c["price"]
+    return changes
+
+def _record_changes(conn, store_url, snapshot_id, catalog_hash, products, now):
+    prev = conn.execute(
+        text("SELECT snapshot_id, catalog_hash FROM snapshot_catalogs WHERE store_url = :u "
+             "ORDER BY snapshot_id DESC LIMIT 1"),
+        {"u": store_url}
+    ).first()
+    conn.execute(
+        text("INSERT INTO snapshot_catalogs (snapshot_id, store_url, catalog_hash) VALUES (:s, :u, :h)"),
+        {"s": snapshot_id, "u": store_url, "h": catalog_hash}
+    )
+    if prev is None or prev[1] == catalog_hash:
+        return  # first tracked catalog of the store, or nothing changed
+    changes = diff_catalogs(_stored_catalog_index(conn, prev[1]), _catalog_index(products))
+    if changes:
+        conn.execute(
+            text("INSERT INTO product_changes (store_url, snapshot_id, prev_snapshot_id, product_key, product_id, "
+                 f"handle, title, {CHANGE}, old_price, new_price, created_at) "
+                 "VALUES (:u, :s, :ps, :product_key, :product_id, :handle, :title, :change, :old_price, :new_price, :t)"),
+            [{"u": store_url, "s": snapshot_id, "ps": prev[0], "t": now, **c} for c in changes]
         )
-        return int(res.lastrowid)
+
+def _load_products(conn, manifest: bytes):
+    hashes = [manifest[i:i + DIGEST_SIZE].hex() for i in range(0, len(manifest), DIGEST_SIZE)]
+    bodies = {}
+    uniq = list(dict.fromkeys(hashes))
+    for i in range(0, len(uniq), CHUNK):
+        chunk = uniq[i:i + CHUNK]
+        params = {f"h{n}": h for n, h in enumerate(chunk)}
+        marks = ", ".join(f":{k}" for k in params)
+        for h, body in conn.execute(text(f"SELECT hash, body FROM snapshot_products WHERE hash IN ({marks})"), params):
+            bodies[h] = body
+    return [orjson.loads(bodies[h]) for h in hashes]
+
+def _rebuild(conn, stored: dict) -> dict:
+    """Full payload from a manifest row (legacy full-payload rows pass through)."""
+    if "__sections__" not in stored:
+        return stored
+    refs = stored["__sections__"]
+    params = {f"h{n}": h for n, h in enumerate(refs.values())}
+    rows = {}
+    if params:
+        marks = ", ".join(f":{k}" for k in params)
+        rows = {h: (kind, body) for h, kind, body in conn.execute(
+            text(f"SELECT hash, section, body FROM snapshot_sections WHERE hash IN ({marks})"), params)}
+    sections = {}
+    for section, h in refs.items():
+        kind, body = rows[h]
+        sections[section] = _load_products(conn, body) if kind == CATALOG_MANIFEST else orjson.loads(body)
+    policies = sections.pop("policies", {})
+    return {k: policies[k] if k in POLICY_KEYS else sections[k] for k in stored["__keys__"]}
+
+def load_snapshot(snapshot_id: int):
+    """{"id", "store_url", "created_at", "snapshot"} for one snapshot, or None."""
+    with ENGINE.begin() as conn:
+        row = conn.execute(
+            text("SELECT id, store_url, snapshot_json, created_at FROM brand_snapshots WHERE id = :i"),
+            {"i": snapshot_id}
+        ).mappings().first()
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "store_url": row["store_url"],
+            "created_at": row["created_at"],
+            "snapshot": _rebuild(conn, orjson.loads(row["snapshot_json"])),
+        }
 
 def latest_snapshots(limit: int = 10):
     with ENGINE.begin() as conn:
@@ -39,4 +401,216 @@ def latest_snapshots(limit: int = 10):
             text("SELECT id, store_url, created_at FROM brand_snapshots ORDER BY id DESC LIMIT :l"),
             {"l": limit}
         ).mappings().all()
-    return [dict(r) for r in rows]
\ No newline at end of file
+    return [dict(r) for r in rows]
+
+# Listing queries use keyset pagination: pass the last id (or store_url) of a page
+# back as the cursor instead of an OFFSET, so deep pages cost the same as the first.
+
+def snapshots_page(before_id=None, since=None, until=None, limit: int = 10):
+    """
+    Newest-first snapshots, optionally within [since, until); cursor is the last
+    id seen. Ordered by (created_at, id) so ix_brand_snapshots_created serves
+    both the range and the order.
+    """
+    sql = "SELECT id, store_url, created_at FROM brand_snapshots WHERE 1 = 1"
+    params = {"l": limit}
+    if before_id is not None:
+        sql += " AND (created_at, id) < (SELECT created_at, id FROM brand_snapshots WHERE id = :b)"
+        params["b"] = before_id
+    if since is not None:
+        sql += " AND created_at >= :s"
+        params["s"] = since
+    if until is not None:
+        sql += " AND created_at < :u"
+        params["u"] = until
+    sql += " ORDER BY created_at DESC, id DESC LIMIT :l"
+    with ENGINE.begin() as conn:
+        rows = conn.execute(text(sql), params).mappings().all()
+    return [dict(r) for r in rows]
+
+def store_history(store_url: str, before_id=None, limit: int = 50):
+    """One store's snapshots, newest first (served by ix_brand_snapshots_store)."""
+    sql = "SELECT id, store_url, created_at FROM brand_snapshots WHERE store_url = :u"
+    params = {"u": store_url, "l": limit}
+    if before_id is not None:
+        sql += " AND id < :b"
+        params["b"] = before_id
+    sql += " ORDER BY id DESC LIMIT :l"
+    with ENGINE.begin() as conn:
+        rows = conn.execute(text(sql), params).mappings().all()
+    return [dict(r) for r in rows]
+
+def latest_per_store(after_store=None, limit: int = 50):
+    """Latest snapshot of every store, ordered by store_url; cursor is the last store_url seen."""
+    inner = "SELECT store_url, MAX(id) AS id FROM brand_snapshots"
+    params = {"l": limit}
+    if after_store is not None:
+        inner += " WHERE store_url > :a"
+        params["a"] = after_store
+    inner += " GROUP BY store_url ORDER BY store_url LIMIT :l"
+    sql = (f"SELECT b.id, b.store_url, b.created_at FROM brand_snapshots b "
+           f"JOIN ({inner}) m ON b.id = m.id ORDER BY b.store_url")
+    with ENGINE.begin() as conn:
+        rows = conn.execute(text(sql), params).mappings().all()
+    return [dict(r) for r in rows]
+
+def product_changes(since=None, until=None, store_urls=None, change=None, before_id=None, limit: int = 100):
+    """Recorded catalog changes, newest first; cursor is the last id seen."""
+    sql = ("SELECT id, store_url, snapshot_id, prev_snapshot_id, product_key, product_id, handle, title, "
+           f"{CHANGE}, old_price, new_price, created_at FROM product_changes WHERE 1 = 1")
+    params = {"l": limit}
+    if since is not None:
+        sql += " AND created_at >= :s"
+        params["s"] = since
+    if until is not None:
+        sql += " AND created_at < :u"
+        params["u"] = until
+    if store_urls:
+        marks = []
+        for n, u in enumerate(store_urls):
+            params[f"st{n}"] = u
+            marks.append(f":st{n}")
+        sql += f" AND store_url IN ({', '.join(marks)})"
+    if change:
+        sql += f" AND {CHANGE} = :c"
+        params["c"] = change
+    if before_id is not None:
+        sql += " AND id < :b"
+        params["b"] = before_id
+    sql += " ORDER BY id DESC LIMIT :l"
+    with ENGINE.begin() as conn:
+        rows = conn.execute(text(sql), params).mappings().all()
+    return [dict(r) for r in rows]
+
+def _snapshot_catalog_index(conn, snapshot_id: int):
+    row = conn.execute(
+        text("SELECT store_url, snapshot_json FROM brand_snapshots WHERE id = :i"), {"i": snapshot_id}
+    ).first()
+    if row is None:
+        return None, None
+    stored = orjson.loads(row[1])
+    h = stored.get("__sections__", {}).get(CATALOG)
+    if h is None:
+        return row[0], _catalog_index(stored.get(CATALOG) or [])  # legacy full-payload row
+    kind, body = conn.execute(text("SELECT section, body FROM snapshot_sections WHERE hash = :h"), {"h": h}).first()
+    if kind != CATALOG_MANIFEST:
+        return row[0], _catalog_index(orjson.loads(body) or [])
+    return row[0], _stored_catalog_index(conn, h)
+
+def diff_snapshots(from_id: int, to_id: int):
+    """Catalog diff between any two snapshots, or None if either is missing."""
+    with ENGINE.begin() as conn:
+        from_store, old = _snapshot_catalog_index(conn, from_id)
+        to_store, new = _snapshot_catalog_index(conn, to_id)
+    if old is None or new is None:
+        return None
+    changes = diff_catalogs(old, new)
+    counts = {kind: sum(1 for c in changes if c["change"] == kind) for kind in ("added", "removed", "repriced")}
+    return {"from": {"id": from_id, "store_url": from_store}, "to": {"id": to_id, "store_url": to_store},
+            "counts": counts, "changes": changes}
+
+# ---------- full-text search ----------
+# search_documents holds the searchable text of each store's latest complete snapshot: product
+# titles, policy excerpts, FAQ pairs and the about excerpt, one row each. Saving a
+# snapshot replaces its store's rows. Matching and ranking use FTS5 (bm25) on SQLite and
+# a FULLTEXT index in boolean mode on MySQL; anything else scans with LIKE, unranked.
+SEARCH_KINDS = ("product", "privacy_policy", "refund_policy", "return_policy", "faq", "about")
+_SEARCH_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+def _search_rows(payload: dict):
+    """(kind, ref, title, body) of every searchable piece of a payload."""
+    for p in payload.get(CATALOG) or []:
+        if p.get("title"):
+            yield "product", p.get("url") or p.get("handle"), p["title"], None
+    for kind in ("privacy_policy", "refund_policy", "return_policy"):
+        if payload.get(f"{kind}_excerpt"):
+            yield kind, payload.get(f"{kind}_url"), None, payload[f"{kind}_excerpt"]
+    faqs = payload.get("brand_faqs") or {}
+    for pair in faqs.get("qa_pairs") or []:
+        yield "faq", faqs.get("url"), pair.get("q"), pair.get("a")
+    about = payload.get("brand_context") or {}
+    if about.get("about_excerpt"):
+        yield "about", about.get("about_url"), None, about["about_excerpt"]
+
+def _index_snapshot(conn, store_url, snapshot_id, payload):
+    conn.execute(text("DELETE FROM search_documents WHERE store_url = :u"), {"u": store_url})
+    rows = [{"u": store_url, "s": snapshot_id, "k": kind, "r": str(ref) if ref is not None else None, "t": title, "b": body}
+            for kind, ref, title, body in _search_rows(payload)]
+    if rows:
+        conn.execute(
+            text("INSERT INTO search_documents (store_url, snapshot_id, kind, ref, title, body) "
+                 "VALUES (:u, :s, :k, :r, :t, :b)"),
+            rows
+        )
+
+def reindex_search() -> int:
+    """Index every store's latest complete snapshot (snapshots saved before search existed); returns the store count."""
+    count, after = 0, None
+    while True:
+        stores = latest_per_store(after, 100)
+        for row in stores:
+            snap = load_snapshot(row["id"])
+            if snap["snapshot"].get("partial"):
+                continue  # save_snapshot leaves partial snapshots out of the index too
+            with ENGINE.begin() as conn:
+                _index_snapshot(conn, row["store_url"], row["id"], snap["snapshot"])
+            count += 1
+        if len(stores) < 100:
+            return count
+        after = stores[-1]["store_url"]
+
+def _search_terms(query: str):
+    """[(words, prefix)]: "quoted phrases" stay together, a trailing * matches prefixes."""
+    terms = []
+    for phrase, word in _SEARCH_TERM.findall(query):
+        words = re.findall(r"\w+", phrase or word)
+        if words:
+            terms.append((words, bool(word) and word.endswith("*")))
+    if not terms:
+        raise ValueError("q has no searchable words")
+    return terms
+
+def _search_mode(conn) -> str:
+    dialect = conn.dialect.name
+    if dialect == "mysql":
+        return "fulltext"
+    if dialect == "sqlite" and conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_fts'")).first():
+        return "fts5"
+    return "like"
+
+def search_snapshots(query: str, kinds=None, store_urls=None, offset: int = 0, limit: int = 20):
+    """
+    Documents matching every term of query, best first (higher score is better).
+    Ranked results have no stable key to resume from, so pages are taken by offset.
+    """
+    terms = _search_terms(query)
+    params = {"l": limit, "o": offset}
+    where = []
+    if kinds:
+        where.append("d.kind IN ({})".format(", ".join(f":k{n}" for n in range(len(kinds)))))
+        params.update({f"k{n}": k for n, k in enumerate(kinds)})
+    if store_urls:
+        where.append("d.store_url IN ({})".format(", ".join(f":st{n}" for n in range(len(store_urls)))))
+        params.update({f"st{n}": u for n, u in enumerate(store_urls)})
+    with ENGINE.begin() as conn:
+        mode = _search_mode(conn)
+        if mode == "fts5":
+            params["q"] = " AND ".join('"{}"{}'.format(" ".join(w), "*" if prefix else "") for w, prefix in terms)
+            # title matches weigh twice as much as body matches
+            score, source = "-bm25(search_fts, 2.0, 1.0)", "search_fts JOIN search_documents d ON d.id = search_fts.rowid"
+            where.insert(0, "search_fts MATCH :q")
+        elif mode == "fulltext":
+            params["q"] = " ".join('+"{}"'.format(" ".join(w)) if len(w) > 1 else f"+{w[0]}{'*' if prefix else ''}"
+                                   for w, prefix in terms)
+            score, source = "MATCH (d.title, d.body) AGAINST (:q IN BOOLEAN MODE)", "search_documents d"
+            where.insert(0, score)
+        else:
+            score, source = "0", "search_documents d"
+            for n, (words, _) in enumerate(terms):
+                params[f"t{n}"] = "%" + " ".join(words).lower() + "%"
+                where.append(f"(LOWER(COALESCE(d.title, '')) LIKE :t{n} OR LOWER(COALESCE(d.body, '')) LIKE :t{n})")
+        sql = (f"SELECT d.id, d.store_url, d.snapshot_id, d.kind, d.ref, d.title, d.body, {score} AS score "
+               f"FROM {source} WHERE {' AND '.join(where)} ORDER BY score DESC, d.id DESC LIMIT :l OFFSET :o")
+        rows = conn.execute(text(sql), params).mappings().all()
+    return [dict(r) for r in rows]
@@ -0,0 +1,84 @@
+# deadlines.py
+"""
+Time budgets for whole requests.
+
+A Deadline bound to the current context (within(), like metrics.tracing)
+caps every storefront fetch made under it: http_client.get and the async
+fetcher use the time left as their timeout (at most their own), and raise
+DeadlineExceeded once none is left, so a crawl's stages fail fast instead of
+each waiting out a full TIMEOUT. The crawl itself stops waiting for stages
+at the deadline and returns the sections that finished, marked partial (see
+shopify_insights.iter_brand_context). CRAWL_BUDGET is the budget per API
+request in seconds (default 100, inside gunicorn's 120 s --timeout); 0
+disables it.
+"""
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+
+BUDGET = float(os.getenv("CRAWL_BUDGET", "100"))
+
+_current = contextvars.ContextVar("crawl_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's budget ran out before this fetch could start."""
+
+
+class Deadline:
+    __slots__ = ("expires",)
+
+    def __init__(self, seconds):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+
+def for_request():
+    """A fresh Deadline of CRAWL_BUDGET seconds, or None when budgets are disabled."""
+    return Deadline(BUDGET) if BUDGET > 0 else None
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def within(deadline):
+    """Bind `deadline` (None: no limit) to this context."""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def bind(deadline, fn, *args, **kwargs):
+    """Run fn with `deadline` bound; for work submitted to other threads."""
+    with within(deadline):
+        return fn(*args, **kwargs)
+
+
+def expired():
+    """True once the current deadline has passed (never without one)."""
+    d = _current.get()
+    return d is not None and d.expired()
+
+
+def remaining():
+    """Seconds left in the current deadline (inf without one)."""
+    d = _current.get()
+    return d.remaining() if d is not None else float("inf")
+
+
+def timeout(seconds):
+    """`seconds` capped at the time left; raises DeadlineExceeded when nothing is left."""
+    left = remaining()
+    if left <= 0:
+        raise DeadlineExceeded("crawl budget exhausted")
+    return min(seconds, left)
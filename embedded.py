@@ -0,0 +1,261 @@
+# embedded.py
+"""
+Structured product data embedded in storefront pages.
+
+Reads the scripts a Page collected (see pages.py) into product records
+shaped like catalog rows (id, title, handle, price, url, image):
+  - JSON-LD: Product/ProductGroup nodes at the top level, in @graph,
+    ItemList/ListItem and mainEntity; prices from Offer, AggregateOffer
+    (lowPrice), priceSpecification and offer arrays; images given as
+    strings, lists or ImageObjects;
+  - Shopify product JSON blobs (<script type="application/json">, e.g.
+    data-product-json sections), prices in cents;
+  - the product in Shopify's inline ShopifyAnalytics.meta script.
+Each script is decoded once with orjson. Records for the same URL are
+merged, so a price or image found in one source fills the gaps of another.
+"""
+import re
+import json
+import logging
+from urllib.parse import urljoin
+
+import orjson
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+PRODUCT_TYPES = frozenset(("Product", "ProductGroup", "IndividualProduct", "ProductModel"))
+# nesting followed inside JSON-LD documents and application/json blobs
+MAX_DEPTH = 6
+FIELDS = ("id", "title", "handle", "price", "url", "image")
+
+_ANALYTICS_META = re.compile(r"var meta = (\{.*?\});\s*for \(var attr in meta\)", re.S)
+
+
+def embedded_products(page, page_url):
+    """Product records from a Page's JSON-LD, product JSON and analytics meta, in that order."""
+    records = []
+    for raw in page.ld_json:
+        records.extend(_ld_products(_loads(raw, page_url)))
+    for raw in page.json_scripts:
+        records.extend(_blob_products(_loads(raw, page_url)))
+    if page.analytics_meta:
+        records.extend(_analytics_products(page.analytics_meta, page_url))
+
+    merged = {}
+    for r in records:
+        url = r.get("url")
+        if not isinstance(url, str) or not url.strip():
+            continue
+        url = urljoin(page_url, url.strip())
+        if not url.startswith(("http://", "https://")):
+            continue
+        r["url"] = url
+        if isinstance(r.get("image"), str):
+            r["image"] = urljoin(page_url, r["image"])
+        if url in merged:
+            seen = merged[url]
+            for k in FIELDS:
+                if seen.get(k) is None:
+                    seen[k] = r.get(k)
+        else:
+            merged[url] = {k: r.get(k) for k in FIELDS}
+            if merged[url]["handle"] is None:
+                merged[url]["handle"] = _handle(url)
+    return list(merged.values())
+
+
+def _handle(url):
+    if "/products/" not in url:
+        return None
+    return url.split("/products/", 1)[1].split("?")[0].split("#")[0].split("/")[0] or None
+
+
+def _loads(raw, page_url):
+    if not raw or not raw.strip():
+        return None
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        pass
+    try:
+        # themes often leave raw newlines/tabs inside JSON strings
+        return json.loads(raw, strict=False)
+    except ValueError:
+        log.debug("unparseable embedded JSON on %s", page_url, exc_info=True)
+        metrics.record_error("embedded_data")
+        return None
+
+
+# ----- JSON-LD -----
+
+def _types(node):
+    t = node.get("@type")
+    names = t if isinstance(t, list) else [t]
+    # "Product", "schema:Product" and "http://schema.org/Product" alike
+    return {n.rsplit("/", 1)[-1].rsplit(":", 1)[-1] for n in names if isinstance(n, str)}
+
+
+def _ld_products(node, depth=0):
+    if depth > MAX_DEPTH:
+        return
+    if isinstance(node, list):
+        for n in node:
+            yield from _ld_products(n, depth + 1)
+        return
+    if not isinstance(node, dict):
+        return
+    types = _types(node)
+    if types & PRODUCT_TYPES:
+        yield _ld_product(node)
+        return
+    if "ListItem" in types:
+        item = node.get("item")
+        if isinstance(item, dict):
+            yield from _ld_products(item, depth + 1)
+            return
+        url = item if isinstance(item, str) else node.get("url")
+        # breadcrumbs are ListItems too; only product links count
+        if isinstance(url, str) and "/products/" in url:
+            yield {"title": _text(node.get("name")), "url": url}
+        return
+    for key in ("@graph", "itemListElement", "mainEntity"):
+        if key in node:
+            yield from _ld_products(node[key], depth + 1)
+
+
+def _ld_product(node):
+    offers = node.get("offers")
+    if offers is None and isinstance(node.get("hasVariant"), list):
+        offers = [v.get("offers") for v in node["hasVariant"] if isinstance(v, dict)]
+    url = node.get("url")
+    if not isinstance(url, str):
+        url = _offer_url(offers)
+    return {
+        "title": _text(node.get("name")),
+        "url": url,
+        "image": _image(node.get("image")),
+        "price": _price(offers),
+    }
+
+
+def _price(offer, depth=0):
+    if depth > MAX_DEPTH:
+        return None
+    if isinstance(offer, list):
+        for o in offer:
+            p = _price(o, depth + 1)
+            if p is not None:
+                return p
+        return None
+    if not isinstance(offer, dict):
+        return None
+    for key in ("price", "lowPrice"):
+        p = _money(offer.get(key))
+        if p is not None:
+            return p
+    return _price(offer.get("priceSpecification"), depth + 1) or _price(offer.get("offers"), depth + 1)
+
+
+def _offer_url(offer):
+    if isinstance(offer, list):
+        return next((u for u in map(_offer_url, offer) if u), None)
+    if isinstance(offer, dict) and isinstance(offer.get("url"), str):
+        return offer["url"]
+    return None
+
+
+def _image(value):
+    if isinstance(value, str):
+        return value or None
+    if isinstance(value, list):
+        return next((i for i in map(_image, value) if i), None)
+    if isinstance(value, dict):
+        return _image(value.get("url") or value.get("contentUrl") or value.get("src"))
+    return None
+
+
+def _money(value):
+    """JSON-LD price (units) as the catalog's decimal string."""
+    if isinstance(value, str):
+        return value.strip() or None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"{value:.2f}"
+    return None
+
+
+def _text(value):
+    return value.strip() if isinstance(value, str) else None
+
+
+# ----- Shopify product JSON -----
+
+def _cents(value):
+    """Liquid `product | json` price (integer cents) as a decimal string; strings are already decimals."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return f"{value / 100:.2f}"
+    return _text(value) or None
+
+
+def _is_product_json(node):
+    return (isinstance(node.get("handle"), str) and isinstance(node.get("title"), str)
+            and ("variants" in node or "price" in node))
+
+
+def _blob_products(node, depth=0):
+    if depth > MAX_DEPTH:
+        return
+    if isinstance(node, list):
+        for n in node:
+            yield from _blob_products(n, depth + 1)
+    elif isinstance(node, dict):
+        if _is_product_json(node):
+            yield _blob_product(node)
+            return
+        for v in node.values():
+            if isinstance(v, (dict, list)):
+                yield from _blob_products(v, depth + 1)
+
+
+def _blob_product(p):
+    variants = p.get("variants")
+    variant = variants[0] if isinstance(variants, list) and variants else None
+    price = p.get("price")
+    if price is None and isinstance(variant, dict):
+        price = variant.get("price")
+    handle = p["handle"]
+    url = p.get("url") if isinstance(p.get("url"), str) else f"/products/{handle}"
+    return {
+        "id": p.get("id") if isinstance(p.get("id"), int) else None,
+        "title": _text(p.get("title")),
+        "handle": handle,
+        "price": _cents(price),
+        "url": url,
+        "image": _image(p.get("featured_image")) or _image(p.get("images")),
+    }
+
+
+# ----- ShopifyAnalytics.meta -----
+
+def _analytics_products(body, page_url):
+    m = _ANALYTICS_META.search(body)
+    meta = _loads(m.group(1), page_url) if m else None
+    product = meta.get("product") if isinstance(meta, dict) else None
+    if not isinstance(product, dict) or "/products/" not in page_url:
+        return
+    variants = [v for v in product.get("variants") or [] if isinstance(v, dict)]
+    variant = variants[0] if variants else {}
+    # variant names read "<product title> - <variant title>"
+    title = _text(variant.get("name"))
+    suffix = variant.get("public_title")
+    if title and isinstance(suffix, str) and suffix and title.endswith(f" - {suffix}"):
+        title = title[: -len(suffix) - 3]
+    yield {
+        "id": product.get("id") if isinstance(product.get("id"), int) else None,
+        "title": title,
+        "handle": _handle(page_url),
+        "price": _cents(variant.get("price")),
+        "url": page_url,
+        "image": None,
+    }
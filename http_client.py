@@ -0,0 +1,125 @@
+# http_client.py
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry, make_headers
+
+import deadlines
+import metrics
+import politeness
+
+# Connection pool: how many hosts keep pooled connections, and how many per host.
+POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "32"))
+POOL_PER_HOST = int(os.getenv("HTTP_POOL_PER_HOST", "8"))
+# Retry policy for connection errors and throttling/5xx responses.
+RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+MAX_RETRY_AFTER = float(os.getenv("HTTP_MAX_RETRY_AFTER", "10"))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+TIMEOUT = 15
+# bodies read with max_bytes are read in chunks of this size
+CHUNK_BYTES = 65536
+
+# "gzip,deflate" plus "br" when the brotli package is installed (urllib3 decodes it)
+ACCEPT_ENCODING = make_headers(accept_encoding=True)["accept-encoding"]
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class _Retry(Retry):
+    """
+    Retry that honors Retry-After but never sleeps longer than MAX_RETRY_AFTER,
+    and stops retrying (or sleeping) once the request's deadline has passed.
+    """
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, MAX_RETRY_AFTER, deadlines.remaining())
+
+    def get_backoff_time(self):
+        return min(super().get_backoff_time(), deadlines.remaining())
+
+    def is_exhausted(self):
+        return super().is_exhausted() or deadlines.remaining() <= 0
+
+
+def _build_session() -> requests.Session:
+    retry = _Retry(
+        total=RETRIES,
+        backoff_factor=BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=("GET", "HEAD"),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_PER_HOST, max_retries=retry)
+    s = requests.Session()
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    s.headers.update({"Accept-Encoding": ACCEPT_ENCODING, "Connection": "keep-alive"})
+    return s
+
+
+def session() -> requests.Session:
+    """Process-wide keep-alive session shared by every crawler module."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def _retry_history(r):
+    retry = getattr(r.raw, "retries", None)
+    return retry.history if retry is not None else ()
+
+
+def _read_capped(r, max_bytes):
+    """Read r's body into r.content, keeping at most max_bytes; r.truncated tells whether more was left."""
+    body = bytearray()
+    r.truncated = False
+    try:
+        for chunk in r.iter_content(CHUNK_BYTES):
+            body += chunk
+            if len(body) > max_bytes:
+                r.truncated = True
+                metrics.record_truncated()
+                break
+    finally:
+        # a body left unread closes the connection instead of returning it to the pool
+        r.close()
+    r._content = bytes(body[:max_bytes])
+
+
+def get(url: str, headers=None, timeout=TIMEOUT, max_bytes=None, **kwargs) -> requests.Response:
+    """
+    GET paced by the host's shared rate limit (see politeness.py), which the
+    response then adjusts. The timeout is capped by the request's deadline
+    (see deadlines.py); DeadlineExceeded once it has passed. With max_bytes
+    the body is streamed and no more than max_bytes of it is read.
+    """
+    deadlines.timeout(timeout)
+    politeness.acquire(url)
+    timeout = deadlines.timeout(timeout)
+    stream = kwargs.pop("stream", False) or max_bytes is not None
+    start = time.perf_counter()
+    try:
+        r = session().get(url, headers=headers, timeout=timeout, stream=stream, **kwargs)
+        if max_bytes is not None:
+            _read_capped(r, max_bytes)
+    except Exception:
+        metrics.record_fetch(None, 0, 0, time.perf_counter() - start)
+        raise
+    # streamed bodies are not read yet: count what the server announced
+    nbytes = int(r.headers.get("Content-Length") or 0) if stream and max_bytes is None else len(r.content)
+    history = _retry_history(r)
+    metrics.record_fetch(r.status_code, nbytes, len(history), time.perf_counter() - start)
+    politeness.observe(url, r.status_code, politeness.retry_after(r.headers),
+                       throttled=any(h.status in RETRY_STATUSES for h in history))
+    return r
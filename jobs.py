@@ -0,0 +1,215 @@
+# jobs.py
+"""
+Bulk crawl jobs backed by a durable queue in the snapshots database.
+
+A job is a list of store URLs; each URL becomes a crawl_job_items row. Worker
+threads (JOBS_WORKERS per process) claim queued items with an optimistic
+UPDATE, crawl them, and write the result through db.save_snapshot. Claims
+respect a global limit (JOBS_GLOBAL_LIMIT) and a per-host limit
+(JOBS_PER_HOST) counted from the running rows, so they hold across every
+gunicorn worker that shares the database. Items left 'running' by a dead
+process are requeued after JOBS_STALE_AFTER seconds, which counts as an
+attempt towards JOBS_MAX_ATTEMPTS.
+"""
+import os
+import time
+import logging
+import datetime
+import threading
+import uuid
+
+from sqlalchemy import text
+
+from db import ENGINE, save_snapshot
+from schemas import validate_context
+from shopify_insights import _domain
+from context_cache import crawl_context, lookup
+
+WORKERS = int(os.getenv("JOBS_WORKERS", "4"))
+GLOBAL_LIMIT = int(os.getenv("JOBS_GLOBAL_LIMIT", "16"))
+PER_HOST = int(os.getenv("JOBS_PER_HOST", "1"))
+MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "2"))
+STALE_AFTER = float(os.getenv("JOBS_STALE_AFTER", "600"))
+POLL_INTERVAL = 2.0
+MAX_URLS = 10000
+
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+log = logging.getLogger(__name__)
+
+
+# -------------------------- queue --------------------------
+
+def create_job(urls) -> dict:
+    """Queue one item per distinct URL; returns {"job_id", "total"}."""
+    roots, seen = [], set()
+    for u in urls:
+        u = (u or "").strip()
+        if not u:
+            continue
+        root = _domain(u).lower()
+        if root not in seen:
+            seen.add(root)
+            roots.append(root)
+    if not roots:
+        raise ValueError("no valid urls")
+    if len(roots) > MAX_URLS:
+        raise ValueError(f"at most {MAX_URLS} urls per job")
+
+    now = datetime.datetime.utcnow()
+    with ENGINE.begin() as conn:
+        res = conn.execute(text("INSERT INTO crawl_jobs (total, created_at) VALUES (:n, :t)"), {"n": len(roots), "t": now})
+        job_id = int(res.lastrowid)
+        conn.execute(
+            text("INSERT INTO crawl_job_items (job_id, store_url, host, status, attempts) VALUES (:j, :u, :h, 'queued', 0)"),
+            [{"j": job_id, "u": r, "h": r.split("://", 1)[-1]} for r in roots]
+        )
+    wake()
+    return {"job_id": job_id, "total": len(roots)}
+
+
+def _requeue_stale(conn):
+    # a stale claim counts as a failed attempt, so a crawl that keeps hanging stops at MAX_ATTEMPTS
+    conn.execute(
+        text("UPDATE crawl_job_items SET status = CASE WHEN attempts < :m THEN 'queued' ELSE 'failed' END, "
+             "worker = NULL, error = 'worker timed out', finished_at = :f "
+             "WHERE status = 'running' AND claimed_at < :t"),
+        {"m": MAX_ATTEMPTS, "f": datetime.datetime.utcnow(), "t": time.time() - STALE_AFTER}
+    )
+
+
+def claim_next():
+    """Claim one queued item within the global and per-host limits; None when nothing is claimable."""
+    with ENGINE.begin() as conn:
+        _requeue_stale(conn)
+        running = conn.execute(text("SELECT COUNT(*) FROM crawl_job_items WHERE status = 'running'")).scalar()
+        if running >= GLOBAL_LIMIT:
+            return None
+        candidates = conn.execute(
+            text("SELECT i.id, i.store_url FROM crawl_job_items i "
+                 "WHERE i.status = 'queued' AND ("
+                 "  SELECT COUNT(*) FROM crawl_job_items r WHERE r.status = 'running' AND r.host = i.host"
+                 ") < :per_host ORDER BY i.id LIMIT 20"),
+            {"per_host": PER_HOST}
+        ).all()
+        for item_id, store_url in candidates:
+            # optimistic claim: another process may have taken the same row
+            res = conn.execute(
+                text("UPDATE crawl_job_items SET status = 'running', worker = :w, claimed_at = :t, attempts = attempts + 1 "
+                     "WHERE id = :id AND status = 'queued'"),
+                {"w": WORKER_ID, "t": time.time(), "id": item_id}
+            )
+            if res.rowcount == 1:
+                return {"id": item_id, "store_url": store_url}
+    return None
+
+
+def _finish(item_id, snapshot_id=None, error=None):
+    with ENGINE.begin() as conn:
+        if error is None:
+            conn.execute(
+                text("UPDATE crawl_job_items SET status = 'done', snapshot_id = :s, error = NULL, finished_at = :t WHERE id = :id"),
+                {"s": snapshot_id, "t": datetime.datetime.utcnow(), "id": item_id}
+            )
+        else:
+            # retry until MAX_ATTEMPTS, then record the failure
+            conn.execute(
+                text("UPDATE crawl_job_items SET status = CASE WHEN attempts < :m THEN 'queued' ELSE 'failed' END, "
+                     "worker = NULL, error = :e, finished_at = :t WHERE id = :id"),
+                {"m": MAX_ATTEMPTS, "e": error[:1000], "t": datetime.datetime.utcnow(), "id": item_id}
+            )
+
+
+# -------------------------- crawling --------------------------
+
+def crawl_and_save(website_url: str) -> int:
+    """Same flow as /api/brand-context/save; returns the snapshot id."""
+    context = lookup(website_url)
+    if context is None:
+        context = crawl_context(website_url)  # raises NotShopifyError, a ValueError
+    ctx = validate_context(context)
+    return save_snapshot(ctx["store"]["url"], ctx)
+
+
+def run_one(item):
+    try:
+        snapshot_id = crawl_and_save(item["store_url"])
+        _finish(item["id"], snapshot_id=snapshot_id)
+        return
+    except Exception as e:
+        error = str(e) or e.__class__.__name__
+    # outside the except: a failed success-write is recorded as a failure, not raised twice
+    _finish(item["id"], error=error)
+
+
+# -------------------------- workers --------------------------
+
+_wake = threading.Event()
+_started = False
+_start_lock = threading.Lock()
+
+
+def wake():
+    _wake.set()
+
+
+def _worker_loop():
+    while True:
+        try:
+            item = claim_next()
+        except Exception:
+            item = None
+        if item is None:
+            _wake.wait(POLL_INTERVAL)
+            _wake.clear()
+            continue
+        try:
+            run_one(item)
+        except Exception:
+            # the result could not be recorded; the stale sweep requeues the item
+            log.warning("job item %s: recording the result failed", item["id"], exc_info=True)
+
+
+def start_workers(n: int = WORKERS):
+    """Start the daemon worker threads once per process (no-op when n <= 0)."""
+    global _started
+    with _start_lock:
+        if _started or n <= 0:
+            return
+        _started = True
+        for i in range(n):
+            threading.Thread(target=_worker_loop, name=f"crawl-job-{i}", daemon=True).start()
+
+
+# -------------------------- status --------------------------
+
+def job_status(job_id: int):
+    with ENGINE.begin() as conn:
+        job = conn.execute(
+            text("SELECT id, total, created_at FROM crawl_jobs WHERE id = :id"), {"id": job_id}
+        ).mappings().first()
+        if job is None:
+            return None
+        counts = dict(conn.execute(
+            text("SELECT status, COUNT(*) FROM crawl_job_items WHERE job_id = :id GROUP BY status"), {"id": job_id}
+        ).all())
+    out = dict(job)
+    for status in ("queued", "running", "done", "failed"):
+        out[status] = counts.get(status, 0)
+    out["status"] = "finished" if out["queued"] == 0 and out["running"] == 0 else "running"
+    out["progress"] = round((out["done"] + out["failed"]) / out["total"], 4) if out["total"] else 1.0
+    return out
+
+
+def job_items(job_id: int, status=None, after_id: int = 0, limit: int = 100):
+    """Items of a job in id order; pass the last id back as after_id for the next page."""
+    sql = ("SELECT id, store_url, status, attempts, snapshot_id, error, finished_at FROM crawl_job_items "
+           "WHERE job_id = :j AND id > :a")
+    params = {"j": job_id, "a": after_id, "l": limit}
+    if status:
+        sql += " AND status = :s"
+        params["s"] = status
+    sql += " ORDER BY id LIMIT :l"
+    with ENGINE.begin() as conn:
+        rows = conn.execute(text(sql), params).mappings().all()
+    return [dict(r) for r in rows]
@@ -0,0 +1,251 @@
+# metrics.py
+"""
+Crawl instrumentation.
+
+Two views of the same measurements:
+  - a process-wide registry (counters and histograms) rendered in the
+    Prometheus text format by render(), served at /metrics;
+  - an optional per-crawl CrawlTrace (stage timings, fetch counts, bytes,
+    status codes, retries, parse time) returned as the `_timings` block.
+Fetches and parses are attributed to the trace bound to the current context
+(see tracing()/bind()); stage threads re-bind the crawl's trace explicitly.
+Each gunicorn worker keeps its own registry.
+"""
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# seconds
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current = contextvars.ContextVar("crawl_trace", default=None)
+
+
+# -------------------------- registry --------------------------
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., count, sum]
+        self._help = {}
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    h[i] += 1
+            h[-2] += 1
+            h[-1] += seconds
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: list(v) for k, v in self._histograms.items()}
+        lines = []
+        for name, (kind, text) in sorted(self._help.items()):
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (n, labels), value in sorted(counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{_labels(labels)} {_num(value)}")
+            else:
+                for (n, labels), h in sorted(histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, count in zip(BUCKETS, h):
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', _num(bound)),))} {count}")
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {h[-2]}")
+                    lines.append(f"{name}_count{_labels(labels)} {h[-2]}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_num(h[-1])}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels) -> str:
+    if not labels:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+    return "{" + body + "}"
+
+
+def _num(value) -> str:
+    return repr(round(value, 6)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+REGISTRY.describe("crawl_seconds", "histogram", "Wall time of a full brand-context crawl.")
+REGISTRY.describe("crawl_stage_seconds", "histogram", "Wall time of one crawl stage (extractor).")
+REGISTRY.describe("crawl_errors_total", "counter", "Failures an extractor tolerated and replaced with a default.")
+REGISTRY.describe("http_requests_total", "counter", "Storefront HTTP requests by status code (\"error\" when no response).")
+REGISTRY.describe("http_request_seconds", "histogram", "Storefront HTTP request time, including retries.")
+REGISTRY.describe("http_response_bytes_total", "counter", "Storefront response body bytes downloaded.")
+REGISTRY.describe("http_retries_total", "counter", "Storefront requests retried by the HTTP client.")
+REGISTRY.describe("http_truncated_total", "counter", "Storefront bodies left partly unread (size cap reached, or the extractor had enough).")
+REGISTRY.describe("html_parse_seconds", "histogram", "Time spent parsing HTML/XML documents.")
+REGISTRY.describe("host_wait_seconds", "histogram", "Time a request waited for its storefront host's rate limit.")
+REGISTRY.describe("host_throttles_total", "counter", "429/5xx responses that slowed a storefront host's rate.")
+REGISTRY.describe("crawl_coalesced_total", "counter", "Crawls answered by another request's in-flight crawl of the same store.")
+REGISTRY.describe("context_cache_errors_total", "counter", "Context cache lookups (the store was crawled instead) and writes (left uncached) that failed.")
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# -------------------------- per-crawl trace --------------------------
+
+class CrawlTrace:
+    """Timings and fetch statistics for one crawl; as_dict() is the `_timings` block."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.cached = False
+        self.stages = {}
+        self.errors = {}
+        self.fetch = {"requests": 0, "errors": 0, "bytes": 0, "retries": 0, "seconds": 0.0, "wait_seconds": 0.0,
+                      "statuses": {}}
+        self.parse = {"documents": 0, "seconds": 0.0}
+        self._lock = threading.Lock()
+
+    def stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = round(seconds, 4)
+
+    def error(self, where):
+        with self._lock:
+            self.errors[where] = self.errors.get(where, 0) + 1
+
+    def fetched(self, status, nbytes, retries, seconds):
+        with self._lock:
+            f = self.fetch
+            f["requests"] += 1
+            f["bytes"] += nbytes
+            f["retries"] += retries
+            f["seconds"] += seconds
+            if status is None:
+                f["errors"] += 1
+            else:
+                f["statuses"][str(status)] = f["statuses"].get(str(status), 0) + 1
+
+    def waited(self, seconds):
+        with self._lock:
+            self.fetch["wait_seconds"] += seconds
+
+    def parsed(self, seconds):
+        with self._lock:
+            self.parse["documents"] += 1
+            self.parse["seconds"] += seconds
+
+    def finish(self):
+        if self.finished is None:
+            self.finished = time.perf_counter()
+
+    def as_dict(self) -> dict:
+        end = self.finished if self.finished is not None else time.perf_counter()
+        with self._lock:
+            return {
+                "total_seconds": round(end - self.started, 4),
+                "cached": self.cached,
+                "stages": dict(self.stages),
+                "errors": dict(self.errors),
+                "fetch": {**self.fetch, "seconds": round(self.fetch["seconds"], 4),
+                          "wait_seconds": round(self.fetch["wait_seconds"], 4), "statuses": dict(self.fetch["statuses"])},
+                "parse": {**self.parse, "seconds": round(self.parse["seconds"], 4)},
+            }
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def tracing(trace):
+    """Attribute fetches and parses in this context to `trace` (None: registry only)."""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def bind(trace, fn, *args, **kwargs):
+    """Run fn with `trace` bound; for work submitted to other threads."""
+    with tracing(trace):
+        return fn(*args, **kwargs)
+
+
+# -------------------------- recording --------------------------
+
+def record_fetch(status, nbytes, retries, seconds):
+    REGISTRY.inc("http_requests_total", status="error" if status is None else str(status))
+    REGISTRY.observe("http_request_seconds", seconds)
+    if nbytes:
+        REGISTRY.inc("http_response_bytes_total", nbytes)
+    if retries:
+        REGISTRY.inc("http_retries_total", retries)
+    trace = _current.get()
+    if trace is not None:
+        trace.fetched(status, nbytes, retries, seconds)
+
+
+def record_truncated():
+    REGISTRY.inc("http_truncated_total")
+
+
+def record_host_wait(seconds):
+    REGISTRY.observe("host_wait_seconds", seconds)
+    trace = _current.get()
+    if trace is not None and seconds:
+        trace.waited(seconds)
+
+
+def record_host_throttle():
+    REGISTRY.inc("host_throttles_total")
+
+
+def record_coalesced(scope):
+    REGISTRY.inc("crawl_coalesced_total", scope=scope)
+
+
+def record_cache_error(op):
+    REGISTRY.inc("context_cache_errors_total", op=op)
+
+
+def record_parse(seconds):
+    REGISTRY.observe("html_parse_seconds", seconds)
+    trace = _current.get()
+    if trace is not None:
+        trace.parsed(seconds)
+
+
+def record_stage(name, seconds, trace=None):
+    REGISTRY.observe("crawl_stage_seconds", seconds, stage=name)
+    trace = trace if trace is not None else _current.get()
+    if trace is not None:
+        trace.stage(name, seconds)
+
+
+def record_error(where):
+    REGISTRY.inc("crawl_errors_total", where=where)
+    trace = _current.get()
+    if trace is not None:
+        trace.error(where)
+
+
+def record_crawl(seconds):
+    REGISTRY.observe("crawl_seconds", seconds)
@@ -0,0 +1,236 @@
+# pages.py
+"""
+Targeted HTML extraction.
+
+The crawl's extractors only need a handful of things from a page: its
+anchors, <title>, meta description, embedded data scripts (JSON-LD,
+application/json blobs, Shopify's analytics meta), the text of <main>
+(or <body>) and the text of the whole document. A Page holds exactly those.
+PageParser collects them straight from lxml's parser events (the same
+events BeautifulSoup's lxml builder consumes) without building any tree,
+and applies BeautifulSoup's text rules: script/style/template/rt/rp strings
+are not text, and whitespace-only strings outside <pre>/<textarea> collapse
+to one space or newline. So a Page is the same whichever way it is built;
+HTML_PARSER=bs4 builds it from a BeautifulSoup tree instead (Page.from_soup).
+"""
+import os
+
+from lxml import etree
+
+# lxml: parser events straight into a Page; bs4: through a BeautifulSoup tree
+HTML_PARSER = os.getenv("HTML_PARSER", "lxml").lower()
+
+LD_JSON_TYPE = "application/ld+json"
+JSON_TYPE = "application/json"
+JS_TYPES = ("", "text/javascript", "application/javascript")
+# the inline script Shopify storefronts use to fill window.ShopifyAnalytics.meta
+ANALYTICS_MARKERS = ("var meta =", "ShopifyAnalytics.meta")
+META_DESCRIPTION = (("name", "description"), ("property", "og:description"))
+
+# strings under these tags are not text (BeautifulSoup's Script/Stylesheet/... strings)
+_HIDDEN = frozenset(("script", "style", "template", "rt", "rp"))
+_PRESERVE = frozenset(("pre", "textarea"))
+_ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+
+class Page:
+    """What the extractors read from one HTML document."""
+
+    __slots__ = ("title", "meta_description", "anchors", "ld_json", "json_scripts", "analytics_meta", "main_text", "text")
+
+    def __init__(self, title=None, meta_description=None, anchors=(), ld_json=(), json_scripts=(),
+                 analytics_meta=None, main_text=None, text=""):
+        self.title = title                         # text of the first <title>, None without one
+        self.meta_description = meta_description   # content of the first description meta tag
+        self.anchors = list(anchors)               # (href, text, title attribute) per <a href>
+        self.ld_json = list(ld_json)               # JSON-LD script bodies (None when empty)
+        self.json_scripts = list(json_scripts)     # application/json script bodies (None when empty)
+        self.analytics_meta = analytics_meta       # body of the ShopifyAnalytics.meta script, if any
+        self.main_text = main_text                 # get_text(" ") of <main> or <body>, None without either
+        self.text = text                           # get_text(" ") of the whole document
+
+    @classmethod
+    def from_html(cls, html):
+        # one feed, as BeautifulSoup does: libxml2 can split raw <script> text differently across chunks
+        parser = PageParser()
+        parser.feed(html)
+        return parser.close()
+
+    @classmethod
+    def from_soup(cls, soup):
+        title = soup.title
+        meta = soup.select_one('meta[name="description"], meta[property="og:description"]')
+        main = soup.select_one("main") or soup.body
+        inline = (s.string for s in soup.find_all("script") if (s.get("type") or "").lower() in JS_TYPES)
+        return cls(
+            title=title.get_text() if title else None,
+            meta_description=meta.get("content") if meta else None,
+            anchors=[(a["href"], a.get_text(), a.get("title")) for a in soup.find_all("a", href=True)],
+            ld_json=[s.string for s in soup.select(f'script[type="{LD_JSON_TYPE}"]')],
+            json_scripts=[s.string for s in soup.select(f'script[type="{JSON_TYPE}"]')],
+            analytics_meta=next((s for s in inline if _is_analytics_meta(s)), None),
+            main_text=main.get_text(" ") if main else None,
+            text=soup.get_text(" "),
+        )
+
+
+class _Capture:
+    """Strings collected while one element is open."""
+
+    __slots__ = ("depth", "strings", "visible_only")
+
+    def __init__(self, depth, visible_only=True):
+        self.depth = depth
+        self.strings = []
+        self.visible_only = visible_only
+
+
+class PageParser:
+    """
+    Incremental HTML -> Page: feed() text as it arrives, close() returns the Page.
+    Only the open-element stack and the collected strings are kept.
+    """
+
+    def __init__(self):
+        self._parser = etree.HTMLParser(target=self, recover=True, strip_cdata=False)
+        self._stack = []       # open tag names
+        self._hidden = 0       # open _HIDDEN tags
+        self._preserve = 0     # open _PRESERVE tags
+        self._data = []
+        self._captures = []    # open _Capture objects
+        self._text = []
+        self._anchors = []     # (href, _Capture, title attribute)
+        self._ld_json = []     # _Capture per JSON-LD script
+        self._json = []        # _Capture per application/json script
+        self._inline = []      # _Capture per inline JavaScript script
+        self._title = self._main = self._body = None
+        self._meta = None
+        self._started = False
+
+    def feed(self, text):
+        if text and not self._started:
+            self._started = True
+            if text[:1] == "\ufeff":
+                text = text[1:]
+        if text:
+            self._parser.feed(text)
+
+    def close(self):
+        try:
+            self._parser.close()
+        except etree.XMLSyntaxError:
+            pass  # nothing parseable: an empty page
+        self._flush()
+        main = self._main or self._body
+        inline = (_script_body(c) for c in self._inline)
+        return Page(
+            title="".join(self._title.strings) if self._title else None,
+            meta_description=self._meta.get("content") if self._meta is not None else None,
+            anchors=[(href, "".join(c.strings), title) for href, c, title in self._anchors],
+            ld_json=[_script_body(c) for c in self._ld_json],
+            json_scripts=[_script_body(c) for c in self._json],
+            analytics_meta=next((s for s in inline if _is_analytics_meta(s)), None),
+            main_text=" ".join(main.strings) if main else None,
+            text=" ".join(self._text),
+        )
+
+    def main_progress(self):
+        """
+        (get_text(" ") so far, whether it has closed, whether it is <main>) for
+        the element main_text will come from: <body> stands in until a <main>
+        opens; (None, False, False) before either. Text still being read is
+        not included.
+        """
+        capture = self._main or self._body
+        if capture is None:
+            return None, False, False
+        return " ".join(capture.strings), capture not in self._captures, capture is self._main
+
+    # ----- parser target -----
+
+    def start(self, tag, attrib):
+        self._flush()
+        depth = len(self._stack)
+        self._stack.append(tag)
+        if tag == "a":
+            href = attrib.get("href")
+            if href is not None:
+                self._anchors.append((href, self._open(depth), attrib.get("title")))
+        elif tag == "script":
+            kind = attrib.get("type", "").lower()
+            if kind == LD_JSON_TYPE:
+                self._ld_json.append(self._open(depth, visible_only=False))
+            elif kind == JSON_TYPE:
+                self._json.append(self._open(depth, visible_only=False))
+            elif kind in JS_TYPES:
+                self._inline.append(self._open(depth, visible_only=False))
+        elif tag == "meta":
+            if self._meta is None and any(attrib.get(k) == v for k, v in META_DESCRIPTION):
+                self._meta = dict(attrib)
+        elif tag == "title":
+            if self._title is None:
+                self._title = self._open(depth)
+        elif tag == "main":
+            if self._main is None:
+                self._main = self._open(depth)
+        elif tag == "body":
+            if self._body is None:
+                self._body = self._open(depth)
+        if tag in _HIDDEN:
+            self._hidden += 1
+        if tag in _PRESERVE:
+            self._preserve += 1
+
+    def end(self, tag):
+        self._flush()
+        # like BeautifulSoup, close the most recent open tag of that name and everything inside it
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i] == tag:
+                for name in self._stack[i:]:
+                    self._hidden -= name in _HIDDEN
+                    self._preserve -= name in _PRESERVE
+                del self._stack[i:]
+                self._captures = [c for c in self._captures if c.depth < i]
+                break
+
+    def data(self, text):
+        self._data.append(text)
+
+    def comment(self, text):
+        self._flush()
+
+    def pi(self, target, data=None):
+        self._flush()
+
+    def doctype(self, *args):
+        self._flush()
+
+    # ----- strings -----
+
+    def _open(self, depth, visible_only=True):
+        capture = _Capture(depth, visible_only)
+        self._captures.append(capture)
+        return capture
+
+    def _flush(self):
+        if not self._data:
+            return
+        s = "".join(self._data)
+        self._data = []
+        if not self._preserve and not s.strip(_ASCII_SPACES):
+            s = "\n" if "\n" in s else " "
+        visible = not self._hidden
+        if visible:
+            self._text.append(s)
+        for capture in self._captures:
+            if visible or not capture.visible_only:
+                capture.strings.append(s)
+
+
+def _script_body(capture):
+    # a script's .string: its single string, None when empty
+    return capture.strings[0] if len(capture.strings) == 1 else None
+
+
+def _is_analytics_meta(body):
+    return body is not None and all(m in body for m in ANALYTICS_MARKERS)
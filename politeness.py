@@ -0,0 +1,229 @@
+# politeness.py
+"""
+Per-host request pacing shared by every worker.
+
+Each storefront host gets a token bucket: CRAWL_HOST_RATE requests per
+second with bursts of up to CRAWL_HOST_BURST. Backends (POLITENESS):
+  sqlite - buckets in a small SQLite file (POLITENESS_DB) that every
+           gunicorn worker and thread on the machine draws from (default)
+  memory - buckets per process
+  off    - no pacing
+A request takes a token before it is sent and sleeps until that token is
+due; tokens may be taken ahead (the bucket goes negative), so waiters are
+served in order without polling. Responses feed back: a 429 or 5xx halves
+the host's rate (not below CRAWL_HOST_MIN_RATE) and pauses the host for
+its Retry-After (or CRAWL_HOST_BLOCK seconds, at most CRAWL_HOST_MAX_BLOCK);
+every later success adds back a twentieth of the base rate. No wait is
+longer than CRAWL_HOST_MAX_WAIT or outlasts the request's deadline (see
+deadlines.py), and a bucket store that fails never blocks a request.
+"""
+import os
+import time
+import asyncio
+import sqlite3
+import logging
+import tempfile
+import threading
+from urllib.parse import urlparse
+
+import deadlines
+import metrics
+
+log = logging.getLogger(__name__)
+
+BACKEND = os.getenv("POLITENESS", "sqlite")
+DB_PATH = os.getenv("POLITENESS_DB", os.path.join(tempfile.gettempdir(), "brand-insights-hosts.db"))
+RATE = float(os.getenv("CRAWL_HOST_RATE", "5"))
+BURST = float(os.getenv("CRAWL_HOST_BURST", "10"))
+MIN_RATE = float(os.getenv("CRAWL_HOST_MIN_RATE", "0.25"))
+BLOCK = float(os.getenv("CRAWL_HOST_BLOCK", "2"))
+MAX_BLOCK = float(os.getenv("CRAWL_HOST_MAX_BLOCK", "60"))
+MAX_WAIT = float(os.getenv("CRAWL_HOST_MAX_WAIT", "30"))
+# buckets untouched this long are dropped
+IDLE_SECONDS = 24 * 3600
+
+
+def host_key(url):
+    return urlparse(url).netloc.lower()
+
+
+# -------------------------- bucket arithmetic --------------------------
+# A bucket is (tokens, updated, rate): `tokens` as of time `updated`.
+# A pause is expressed as an `updated` in the future, so the refill is
+# negative until then and takers wait it out like any other debt.
+
+def _fresh(now):
+    return (BURST, now, RATE)
+
+
+def _take(bucket, now):
+    """(bucket, seconds to wait) after taking one token."""
+    tokens, updated, rate = bucket
+    tokens = min(BURST, tokens + (now - updated) * rate) - 1
+    return (tokens, now, rate), (-tokens / rate if tokens < 0 else 0.0)
+
+
+def _throttled(bucket, now, pause):
+    tokens, updated, rate = bucket
+    # responses that arrive during a pause belong to the same burst: halve once
+    if updated <= now:
+        rate = max(MIN_RATE, rate / 2)
+    return (0.0, max(updated, now + pause), rate)
+
+
+def _recovered(bucket):
+    tokens, updated, rate = bucket
+    return (tokens, updated, min(RATE, rate + RATE / 20))
+
+
+# -------------------------- backends --------------------------
+
+class MemoryBuckets:
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def update(self, host, fn):
+        """Atomically replace the host's bucket with fn(bucket, now)[0]; returns fn's second value."""
+        with self._lock:
+            now = time.time()
+            bucket, result = fn(self._buckets.get(host) or _fresh(now), now)
+            self._buckets[host] = bucket
+            return result
+
+
+class SqliteBuckets:
+    """Same interface on a SQLite file; one connection per thread, one write transaction per update."""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS host_buckets ("
+                "host TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, rate REAL NOT NULL)"
+            )
+            conn.execute("DELETE FROM host_buckets WHERE updated < ?", (time.time() - IDLE_SECONDS,))
+            self._local.conn = conn
+        return conn
+
+    def update(self, host, fn):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated, rate FROM host_buckets WHERE host = ?", (host,)).fetchone()
+            bucket, result = fn(tuple(row) if row else _fresh(now), now)
+            conn.execute(
+                "INSERT INTO host_buckets (host, tokens, updated, rate) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(host) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated, rate = excluded.rate",
+                (host, *bucket),
+            )
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+_store = None
+_store_lock = threading.Lock()
+# hosts this process last saw below their base rate; only those need success feedback written
+_slowed = set()
+
+
+def store():
+    global _store
+    if _store is None and BACKEND != "off":
+        with _store_lock:
+            if _store is None:
+                _store = SqliteBuckets() if BACKEND == "sqlite" else MemoryBuckets()
+    return _store
+
+
+# -------------------------- pacing --------------------------
+
+def reserve(url):
+    """Take a token for url's host; returns how long to wait before sending (0 when due now)."""
+    s = store()
+    if s is None:
+        return 0.0
+    host = host_key(url)
+
+    def take(bucket, now):
+        bucket, wait = _take(bucket, now)
+        return bucket, (wait, bucket[2])
+
+    try:
+        wait, rate = s.update(host, take)
+    except Exception:
+        log.debug("host bucket unavailable for %s", host, exc_info=True)
+        return 0.0
+    if rate < RATE:
+        _slowed.add(host)
+    else:
+        _slowed.discard(host)
+    wait = min(wait, MAX_WAIT)
+    metrics.record_host_wait(wait)
+    return wait
+
+
+def acquire(url):
+    """Block until a request to url's host is allowed (or the request's deadline passes)."""
+    wait = min(reserve(url), deadlines.remaining())
+    if wait > 0:
+        time.sleep(wait)
+
+
+async def aacquire(url):
+    """acquire() for the event loop: the bucket store is used from a worker thread."""
+    if store() is None:
+        return
+    wait = min(await asyncio.to_thread(reserve, url), deadlines.remaining())
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+
+def _is_throttle(status, throttled):
+    return status == 429 or status >= 500 or throttled
+
+
+def observe(url, status, retry_after=None, throttled=False):
+    """
+    Feed a response back into its host's bucket. `throttled` marks a request
+    whose transparent retries already saw a 429/5xx.
+    """
+    s = store()
+    if s is None or status is None:
+        return
+    host = host_key(url)
+    try:
+        if _is_throttle(status, throttled):
+            pause = min(retry_after if retry_after is not None else BLOCK, MAX_BLOCK)
+            s.update(host, lambda bucket, now: (_throttled(bucket, now, pause), None))
+            _slowed.add(host)
+            metrics.record_host_throttle()
+        elif host in _slowed:
+            s.update(host, lambda bucket, now: (_recovered(bucket), None))
+    except Exception:
+        log.debug("host bucket unavailable for %s", host, exc_info=True)
+
+
+async def aobserve(url, status, retry_after=None, throttled=False):
+    # only throttles and recoveries write to the store
+    if store() is not None and status is not None and (_is_throttle(status, throttled) or host_key(url) in _slowed):
+        await asyncio.to_thread(observe, url, status, retry_after, throttled)
+
+
+def retry_after(headers):
+    """Retry-After in seconds (delta form); None when absent or an HTTP date."""
+    try:
+        return max(0.0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return None
@@ -1,6 +1,15 @@
-from pydantic import BaseModel, HttpUrl, Field
+import os
+from pydantic import BaseModel, HttpUrl, Field, TypeAdapter
 from typing import List, Optional, Dict, Any
 
+from catalog import ProductCatalog, CHUNK
+
+# whole_product_catalog validation in validate_context:
+#   full - every product through the Product model (default)
+#   fast - type checks on the catalog columns; the model only runs if some row fails them
+#   skip - trust the crawler's records as-is
+PRODUCT_VALIDATION = os.getenv("PRODUCT_VALIDATION", "full")
+
 class Product(BaseModel):
     id: Optional[int] = None
     title: Optional[str] = None
@@ -46,6 +55,49 @@ class BrandContext(BaseModel):
     contacts: Contacts
     brand_context: BrandAbout
     important_links: Optional[Dict[str, str]] = None
+    partial: bool = False  # the crawl ran out of its time budget; unfinished sections hold defaults
 
 class BrandContextRequest(BaseModel):
-    website_url: str = Field(..., description="Full https URL or domain")
\ No newline at end of file
+    website_url: str = Field(..., description="Full https URL or domain")
+    stream: bool = Field(False, description="Emit sections as NDJSON while the crawl runs")
+    timings: bool = Field(False, description="Add a _timings block with stage timings and fetch statistics")
+
+_section_adapters: Dict[str, TypeAdapter] = {}
+
+def dump_section(field: str, value: Any):
+    """Validate a single BrandContext field (or a catalog batch) and return it JSON-ready."""
+    adapter = _section_adapters.get(field)
+    if adapter is None:
+        adapter = _section_adapters[field] = TypeAdapter(BrandContext.model_fields[field].annotation)
+    return adapter.dump_python(adapter.validate_python(value), mode="json")
+
+_products = TypeAdapter(List[Product])
+
+def _plain_row(catalog: ProductCatalog, i: int) -> bool:
+    """Cheap stand-in for Product validation of one catalog row."""
+    pid = catalog.ids[i]
+    if pid is not None and (type(pid) is not int):
+        return False
+    for col in (catalog.titles, catalog.handles, catalog.prices, catalog.images):
+        if col[i] is not None and type(col[i]) is not str:
+            return False
+    url = catalog.urls[i]
+    return url is None or url == "" or (type(url) is str and url.startswith(("http://", "https://")))
+
+def validate_catalog(products, mode: str = PRODUCT_VALIDATION) -> ProductCatalog:
+    """Validate a catalog (list of dicts or ProductCatalog) into a JSON-ready ProductCatalog."""
+    catalog = ProductCatalog.from_records(products)
+    if mode == "skip" or (mode == "fast" and all(_plain_row(catalog, i) for i in range(len(catalog)))):
+        return catalog
+    out = ProductCatalog(catalog.base)
+    for start in range(0, len(catalog), CHUNK):
+        out.extend(_products.dump_python(_products.validate_python(catalog[start:start + CHUNK]), mode="json"))
+    return out
+
+def validate_context(context: dict, mode: str = PRODUCT_VALIDATION) -> dict:
+    """BrandContext(**context).model_dump(mode="json"), with the catalog kept as a ProductCatalog."""
+    catalog = context.get("whole_product_catalog")
+    ctx = BrandContext(**{**context, "whole_product_catalog": None}).model_dump(mode="json")
+    if catalog is not None:
+        ctx["whole_product_catalog"] = validate_catalog(catalog, mode)
+    return ctx
@@ -1,20 +1,128 @@
+import os
 import re
-import json
 import time
-from urllib.parse import urljoin, urlparse
-import requests
+import codecs
+import queue
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse, urlunparse
 from bs4 import BeautifulSoup
 
+import deadlines
+import http_client
+import metrics
+from catalog import ProductCatalog
+from pages import Page, PageParser, HTML_PARSER
+from embedded import embedded_products
+from sitemaps import iter_sitemap
+
+log = logging.getLogger(__name__)
+
 REQ_HEADERS = {
     "User-Agent": "Mozilla/5.0 (compatible; BrandInsightsBot/1.0; +https://example.com/bot)"
 }
 TIMEOUT = 15
-
-def _get(url):
-    return requests.get(url, headers=REQ_HEADERS, timeout=TIMEOUT)
+# parallel stages per crawl, and in-flight requests allowed per storefront host
+CRAWL_WORKERS = int(os.getenv("CRAWL_WORKERS", "8"))
+HOST_CONCURRENCY = int(os.getenv("CRAWL_HOST_CONCURRENCY", "4"))
+# HTML pages are read no further than this many (decompressed) bytes
+PAGE_MAX_BYTES = int(os.getenv("PAGE_MAX_BYTES", str(5 * 1024 * 1024)))
+# streamed pages without a <main> stop after this many times the excerpt length of <body> text
+BODY_TEXT_FACTOR = 8
+
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+def _host_slot(url):
+    host = urlparse(url).netloc.lower()
+    with _host_slots_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(HOST_CONCURRENCY)
+        return _host_slots[host]
+
+def _get(url, max_bytes=None):
+    with _host_slot(url):
+        return http_client.get(url, headers=REQ_HEADERS, timeout=TIMEOUT, max_bytes=max_bytes)
 
 def _soup(html):
-    return BeautifulSoup(html, "lxml")
+    start = time.perf_counter()
+    soup = BeautifulSoup(html, "lxml")
+    metrics.record_parse(time.perf_counter() - start)
+    return soup
+
+def _page(html):
+    """The parts of a page the extractors read (see pages.py), without a soup unless HTML_PARSER=bs4."""
+    if HTML_PARSER == "bs4":
+        return Page.from_soup(_soup(html))
+    start = time.perf_counter()
+    page = Page.from_html(html)
+    metrics.record_parse(time.perf_counter() - start)
+    return page
+
+def _decoder(encoding):
+    try:
+        return codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+    except LookupError:
+        return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+def _stream_page(url, enough=None):
+    """
+    Page from a streamed read of url, fed to a PageParser as the body arrives
+    and stopped at PAGE_MAX_BYTES or as soon as enough(parser) holds.
+    """
+    if HTML_PARSER == "bs4":
+        return _page(_get(url, PAGE_MAX_BYTES).text)
+    parser, pending, read, parsing = PageParser(), "", 0, 0.0
+    with _host_slot(url):
+        r = http_client.get(url, headers=REQ_HEADERS, timeout=TIMEOUT, stream=True)
+        try:
+            decoder = _decoder(r.encoding)
+            for chunk in r.iter_content(http_client.CHUNK_BYTES):
+                chunk = chunk[:PAGE_MAX_BYTES - read]
+                read += len(chunk)
+                # feed up to the last "<" only: libxml2 misreads tags split across feeds
+                pending += decoder.decode(chunk)
+                cut = pending.rfind("<")
+                if cut > 0:
+                    start = time.perf_counter()
+                    parser.feed(pending[:cut])
+                    parsing += time.perf_counter() - start
+                    pending = pending[cut:]
+                if read >= PAGE_MAX_BYTES or (enough is not None and enough(parser)):
+                    metrics.record_truncated()
+                    break
+            pending += decoder.decode(b"", final=True)
+        finally:
+            r.close()
+    start = time.perf_counter()
+    parser.feed(pending)
+    page = parser.close()
+    metrics.record_parse(parsing + time.perf_counter() - start)
+    return page
+
+def _enough_text(max_chars):
+    """
+    enough() for _stream_page: the clean text of <main> is complete or
+    max_chars long. Before any <main> the page may still have a header and
+    navigation to get through, so <body> text only counts at BODY_TEXT_FACTOR
+    times max_chars.
+    """
+    def enough(parser):
+        text, closed, is_main = parser.main_progress()
+        if text is None:
+            return False
+        if not is_main:
+            return len(_clean_text(text)) >= BODY_TEXT_FACTOR * max_chars
+        return closed or len(_clean_text(text)) >= max_chars
+    return enough
+
+def _swallow(where, url):
+    """Log and count a failure an extractor tolerates (it still returns its default)."""
+    log.debug("%s failed for %s", where, url, exc_info=True)
+    metrics.record_error(where)
 
 def _clean_text(s):
     return re.sub(r"\s+", " ", (s or "").strip())
@@ -23,121 +131,477 @@ def _domain(url):
     parsed = urlparse(url if url.startswith("http") else f"https://{url}")
     return f"{parsed.scheme}://{parsed.netloc}"
 
-def is_shopify_site(website_url: str):
-    """Lightweight Shopify heuristic: fingerprints in HTML/headers and common routes."""
+def _norm_url(url):
+    """Cache key for a URL: lowercase scheme/host, '/' for an empty path, no fragment."""
+    parsed = urlparse(url if url.startswith("http") else f"https://{url}")
+    return urlunparse((parsed.scheme.lower(), parsed.netloc.lower(), parsed.path or "/", parsed.params, parsed.query, ""))
+
+class PageCache:
+    """
+    Crawl-scoped document cache keyed by normalized URL.
+    Each URL is fetched at most once and parsed at most once per crawl
+    (into a Page; FAQ pages also into a soup); a failed fetch is remembered
+    and re-raised instead of retried. Bodies are capped at PAGE_MAX_BYTES.
+    Text pages (text_page) are streamed only as far as their extractor needs
+    and kept apart from full pages.
+    """
+
+    def __init__(self):
+        self._responses = {}
+        self._soups = {}
+        self._pages = {}
+        self._text_pages = {}
+        self._links = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _memo(self, store, key, compute):
+        # concurrent stages asking for the same URL wait for a single fetch/parse
+        if key in store:
+            return store[key]
+        with self._lock:
+            key_lock = self._key_locks.setdefault((id(store), key), threading.Lock())
+        with key_lock:
+            if key not in store:
+                store[key] = compute()
+        return store[key]
+
+    def get(self, url):
+        def fetch():
+            try:
+                return _get(url, PAGE_MAX_BYTES)
+            except Exception as e:
+                return e
+        r = self._memo(self._responses, _norm_url(url), fetch)
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+    def soup(self, url):
+        return self._memo(self._soups, _norm_url(url), lambda: _soup(self.get(url).text))
+
+    def page(self, url):
+        def parse():
+            if HTML_PARSER == "bs4":
+                return Page.from_soup(self.soup(url))
+            return _page(self.get(url).text)
+        return self._memo(self._pages, _norm_url(url), parse)
+
+    def text_page(self, url, enough=None):
+        """page(url) if the response is already here, else a Page streamed only until enough(parser) (see _stream_page)."""
+        key = _norm_url(url)
+        if key in self._responses:
+            return self.page(url)
+        def fetch():
+            try:
+                return _stream_page(url, enough)
+            except Exception as e:
+                return e
+        page = self._memo(self._text_pages, key, fetch)
+        if isinstance(page, Exception):
+            raise page
+        return page
+
+    def links(self, url):
+        return self._memo(self._links, _norm_url(url), lambda: scan_links(self.page(url), url))
+
+def _fetch(url, cache=None):
+    return cache.get(url) if cache is not None else _get(url, PAGE_MAX_BYTES)
+
+def _fetch_soup(url, cache=None):
+    return cache.soup(url) if cache is not None else _soup(_get(url, PAGE_MAX_BYTES).text)
+
+def _fetch_page(url, cache=None):
+    return cache.page(url) if cache is not None else _page(_get(url, PAGE_MAX_BYTES).text)
+
+def _fetch_text_page(url, enough, cache=None):
+    return cache.text_page(url, enough) if cache is not None else _stream_page(url, enough)
+
+def _fetch_links(url, cache=None):
+    return cache.links(url) if cache is not None else scan_links(_fetch_page(url), url)
+
+# -------------------------- LINKS --------------------------
+
+# lowercase href substring -> labels it sets; matched in one pass per anchor
+LINK_KEYWORDS = {
+    "privacy": ("privacy",),
+    "policy": ("policy",),
+    "refund": ("refund",),
+    "return": ("return",),
+    "faq": ("faq",),
+    "frequently-asked": ("faq",),
+    "/pages/about": ("about",),
+    "about-us": ("about",),
+    "contact": ("contact_page", "contact_us"),
+    "support": ("contact_page",),
+    "track": ("order_tracking",),
+    "blog": ("blog",),
+}
+# case-sensitive href substring -> social network, checked in this order
+SOCIAL_DOMAINS = {
+    "instagram.com": "instagram",
+    "facebook.com": "facebook",
+    "tiktok.com": "tiktok",
+    "youtube.com": "youtube",
+    "x.com": "twitter",
+    "twitter.com": "twitter",
+}
+SOCIAL_ORDER = ("instagram", "facebook", "tiktok", "youtube", "twitter")
+
+# lookahead alternation so overlapping keywords in one href are all reported
+_LINK_RE = re.compile("(?=(" + "|".join(re.escape(k) for k in LINK_KEYWORDS) + "))")
+_SOCIAL_RE = re.compile("(?=(" + "|".join(re.escape(k) for k in SOCIAL_DOMAINS) + "))")
+
+def scan_links(page, base_url):
+    """
+    Walk the page's anchors once and classify every href.
+    Returns {"first": {label: (anchor_index, absolute_url)}, "socials": {...},
+             "emails": [...], "phones": [...]} where "first" keeps the first
+    anchor per label, matching what the per-extractor scans used to pick.
+    """
+    base = _domain(base_url)
+    first, socials, emails, phones = {}, {}, [], []
+    for i, (href, _, _) in enumerate(page.anchors):
+        for kw in {m.group(1) for m in _LINK_RE.finditer(href.lower())}:
+            for label in LINK_KEYWORDS[kw]:
+                if label not in first:
+                    first[label] = (i, urljoin(base, href))
+
+        nets = {SOCIAL_DOMAINS[m.group(1)] for m in _SOCIAL_RE.finditer(href)}
+        for net in SOCIAL_ORDER:
+            # twitter keeps the last match, the others the first
+            if net in nets and (net == "twitter" or net not in socials):
+                socials[net] = href
+                break
+
+        if href.startswith("mailto:"):
+            emails.append(href.replace("mailto:", "").strip())
+        if href.startswith("tel:"):
+            phones.append(re.sub(r"[^0-9+]", "", href.replace("tel:", "")))
+    return {"first": first, "socials": socials, "emails": emails, "phones": phones}
+
+def _first_link(links, labels):
+    hits = [links["first"][l] for l in labels if l in links["first"]]
+    return min(hits)[1] if hits else None
+
+# Shopify detection runs cheapest-first: response headers, a string search of
+# the first DETECT_BYTES of the homepage, /products.json?limit=1 and /meta.json
+# probes, and only then a full parse for product/collection links. Without a
+# PageCache the homepage is streamed and abandoned as soon as a tier answers.
+DETECT_BYTES = int(os.getenv("SHOPIFY_DETECT_BYTES", "65536"))
+VERDICT_TTL = float(os.getenv("SHOPIFY_VERDICT_TTL", "3600"))
+VERDICT_CACHE_SIZE = 4096
+
+SHOPIFY_HEADERS = ("x-shopid", "x-shopify-stage", "x-sorting-hat-shopid", "x-storefront-renderer-rendered")
+SHOPIFY_MARKERS = ("cdn.shopify.com", "shopify-buy", "shopify.theme", ".myshopify.com")
+
+_verdicts = OrderedDict()  # host -> (ok, reason, expires_at)
+_verdicts_lock = threading.Lock()
+
+def _cached_verdict(host):
+    with _verdicts_lock:
+        hit = _verdicts.get(host)
+        if hit is None:
+            return None
+        if hit[2] < time.time():
+            del _verdicts[host]
+            return None
+        _verdicts.move_to_end(host)
+        return hit[0], hit[1]
+
+def _remember_verdict(host, ok, reason):
+    with _verdicts_lock:
+        _verdicts[host] = (ok, reason, time.time() + VERDICT_TTL)
+        _verdicts.move_to_end(host)
+        while len(_verdicts) > VERDICT_CACHE_SIZE:
+            _verdicts.popitem(last=False)
+
+def _shopify_headers(headers):
+    if any(h in headers for h in SHOPIFY_HEADERS):
+        return True
+    return ("shopify" in headers.get("Server", "").lower()
+            or "shopify" in headers.get("X-Powered-By", "").lower()
+            or "_shopify_" in headers.get("Set-Cookie", ""))
+
+def _shopify_markers(text):
+    text = text.lower()
+    return any(m in text for m in SHOPIFY_MARKERS)
+
+def _read_head(url):
+    """Status, headers and the first DETECT_BYTES of the body, without downloading the rest."""
+    with _host_slot(url):
+        r = http_client.get(url, headers=REQ_HEADERS, timeout=TIMEOUT, stream=True)
+        try:
+            head = b""
+            if r.status_code < 400:
+                for chunk in r.iter_content(16384):
+                    head += chunk
+                    if len(head) >= DETECT_BYTES:
+                        break
+            return r.status_code, r.headers, head[:DETECT_BYTES].decode(r.encoding or "utf-8", "replace")
+        finally:
+            r.close()
+
+def _probe_shopify_json(base, cache=None):
+    """Reason string if /products.json or /meta.json answers like a Shopify store, else None."""
+    for path, key in (("/products.json?limit=1", "products"), ("/meta.json", "myshopify_domain")):
+        try:
+            r = _fetch(f"{base}{path}", cache)
+            if r.status_code == 200 and key in r.json():
+                return path.split("?")[0].lstrip("/")
+        except Exception:
+            continue
+    return None
+
+def is_shopify_site(website_url: str, cache=None):
+    """
+    Tiered Shopify check (see DETECT_BYTES); returns (ok, reason). Verdicts are
+    cached per host for VERDICT_TTL seconds. With a PageCache the full homepage
+    is fetched into it, since the crawl that follows needs it anyway. Raises
+    DeadlineExceeded when the request's deadline passes before a verdict.
+    """
     try:
-        r = _get(website_url if website_url.startswith("http") else f"https://{website_url}")
-        if r.status_code >= 400:
-            return False, f"status {r.status_code}"
-        soup = _soup(r.text)
-        txt = r.text.lower()
-        hints = [
-            "cdn.shopify.com" in txt,
-            "shopify-buy" in txt,
-            "x-shopid" in [k.lower() for k in r.headers.keys()],
-            "Shopify" in r.headers.get("Server", ""),
-            bool(soup.select('a[href*="/products"]') or soup.select('a[href*="/collections"]')),
-        ]
-        if any(hints):
-            return True, "looks like shopify"
-        return False, "no shopify fingerprints found"
+        url = website_url if website_url.startswith("http") else f"https://{website_url}"
+        host = urlparse(url).netloc.lower()
+        verdict = _cached_verdict(host)
+        if verdict is not None:
+            return verdict
+
+        if cache is not None:
+            r = cache.get(url)
+            status, headers, head = r.status_code, r.headers, r.text
+        else:
+            status, headers, head = _read_head(url)
+        if status >= 400:
+            return False, f"status {status}"
+
+        if _shopify_headers(headers):
+            verdict = True, "shopify headers"
+        elif _shopify_markers(head):
+            verdict = True, "looks like shopify"
+        else:
+            probe = _probe_shopify_json(_domain(url), cache)
+            if probe:
+                verdict = True, f"{probe} responds"
+            else:
+                anchors = _fetch_page(url, cache).anchors
+                if any("/products" in href or "/collections" in href for href, _, _ in anchors):
+                    verdict = True, "looks like shopify"
+                else:
+                    verdict = False, "no shopify fingerprints found"
+        _remember_verdict(host, *verdict)
+        return verdict
     except Exception as e:
+        if deadlines.expired():
+            # out of time, which says nothing about the store
+            raise deadlines.DeadlineExceeded("crawl budget exhausted during the Shopify check") from e
         return False, str(e)
 
 # -------------------------- PRODUCTS --------------------------
 
-def fetch_products_json(base_url, max_pages=5, per_page=250):
-    products, seen_ids = [], set()
+# catalog paging: hard page cap (250 products each) and max pages fetched at once per store
+CATALOG_MAX_PAGES = int(os.getenv("CATALOG_MAX_PAGES", "200"))
+CATALOG_CONCURRENCY = int(os.getenv("CATALOG_CONCURRENCY", "4"))
+CATALOG_MAX_THROTTLES = 5
+CATALOG_MAX_BACKOFF = 30.0
+
+def _products_page_url(base, page, per_page, since_id=None):
+    if since_id:
+        return f"{base}/products.json?limit={per_page}&since_id={since_id}"
+    return f"{base}/products.json?limit={per_page}&page={page}"
+
+def _product_record(p, base):
+    handle = p.get("handle")
+    first_variant = (p.get("variants") or [{}])[0]
+    price = first_variant.get("price")
+    image = (p.get("images") or [{}])[0].get("src")
+    return {
+        "id": p.get("id"),
+        "title": p.get("title"),
+        "handle": handle,
+        "price": price,
+        "url": urljoin(base, f"/products/{handle}") if handle else None,
+        "image": image
+    }
+
+def _retry_after(r):
+    try:
+        return float(r.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def _products_page(r):
+    """(status, products, retry_after) for one products.json response."""
+    if r.status_code != 200:
+        return r.status_code, None, _retry_after(r)
+    return 200, r.json().get("products", []), None
+
+class _PageWindow:
+    """
+    How many catalog pages to request at once. Starts at one page, doubles
+    while the store answers normally (up to `limit`) and drops back to one
+    page on 429/5xx, waiting Retry-After or an exponential backoff.
+    """
+
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self.width = 1
+        self.throttles = 0
+
+    def ok(self):
+        self.throttles = 0
+        self.width = min(self.limit, self.width * 2)
+
+    def throttled(self, retry_after=None):
+        """Seconds to wait before retrying, or None once the store keeps refusing."""
+        self.throttles += 1
+        self.width = 1
+        if self.throttles > CATALOG_MAX_THROTTLES:
+            return None
+        return min(retry_after if retry_after is not None else 0.5 * 2 ** self.throttles, CATALOG_MAX_BACKOFF)
+
+def _fetch_products_page(base, page, per_page):
+    return _products_page(_get(_products_page_url(base, page, per_page)))
+
+def _iter_products_since(base, since_id, seen_ids, window, max_pages, per_page):
+    """Cursor paging for stores that ignore ?page=; sequential by nature."""
+    pages = 0
+    while pages < max_pages:
+        status, data, retry_after = _products_page(_get(_products_page_url(base, None, per_page, since_id)))
+        if status == 429 or status >= 500:
+            delay = window.throttled(retry_after)
+            if delay is None:
+                return
+            time.sleep(min(delay, deadlines.remaining()))
+            continue
+        if status != 200 or not data:
+            return
+        window.ok()
+        pages += 1
+        for p in data:
+            pid = p.get("id")
+            if pid in seen_ids:
+                continue
+            seen_ids.add(pid)
+            since_id = pid
+            yield _product_record(p, base)
+
+def iter_products_json(base_url, max_pages=None, per_page=250, concurrency=None):
+    """
+    Stream the whole products.json catalog as product records.
+    Pages are fetched in windows of up to `concurrency` at once and yielded in
+    page order; 429/5xx shrink the window and back off instead of failing.
+    """
     base = _domain(base_url)
-    since_id = None
-    for i in range(max_pages):
-        try:
-            if since_id:
-                url = f"{base}/products.json?limit={per_page}&since_id={since_id}"
+    max_pages = max_pages or CATALOG_MAX_PAGES
+    window = _PageWindow(concurrency or CATALOG_CONCURRENCY)
+    seen_ids, last_id = set(), None
+    page = 1
+    with ThreadPoolExecutor(max_workers=window.limit) as pool:
+        while page <= max_pages:
+            batch = list(range(page, min(page + window.width, max_pages + 1)))
+            try:
+                futures = [pool.submit(contextvars.copy_context().run, _fetch_products_page, base, n, per_page) for n in batch]
+                results = [f.result() for f in futures]
+            except Exception:
+                _swallow("iter_products_json", base_url)
+                return
+            for n, (status, data, retry_after) in zip(batch, results):
+                if status == 429 or status >= 500:
+                    delay = window.throttled(retry_after)
+                    if delay is None:
+                        return
+                    time.sleep(min(delay, deadlines.remaining()))
+                    page = n
+                    break
+                if status != 200 or not data:
+                    return
+                fresh = [p for p in data if p.get("id") not in seen_ids]
+                if not fresh:
+                    # ?page= ignored: the store keeps serving page 1, switch to since_id
+                    yield from _iter_products_since(base, last_id, seen_ids, window, max_pages, per_page)
+                    return
+                for p in fresh:
+                    last_id = p.get("id")
+                    seen_ids.add(last_id)
+                    yield _product_record(p, base)
+                if len(data) < min(per_page, 250):
+                    return  # short page: Shopify caps limit at 250, so this was the last one
             else:
-                url = f"{base}/products.json?limit={per_page}&page={i+1}"
-            r = _get(url)
-            if r.status_code != 200:
-                break
-            data = r.json().get("products", [])
-            if not data:
-                break
-            for p in data:
-                pid = p.get("id")
-                if pid in seen_ids:
-                    continue
-                seen_ids.add(pid)
-                handle = p.get("handle")
-                first_variant = (p.get("variants") or [{}])[0]
-                price = first_variant.get("price")
-                image = (p.get("images") or [{}])[0].get("src")
-                products.append({
-                    "id": pid,
-                    "title": p.get("title"),
-                    "handle": handle,
-                    "price": price,
-                    "url": urljoin(base, f"/products/{handle}") if handle else None,
-                    "image": image
-                })
-                since_id = pid
-        except Exception:
-            break
-        time.sleep(0.4)
+                page = batch[-1] + 1
+                window.ok()
+
+def fetch_products_json(base_url, max_pages=None, per_page=250):
+    products = ProductCatalog(_domain(base_url))
+    try:
+        for p in iter_products_json(base_url, max_pages=max_pages, per_page=per_page):
+            products.append(p)
+    except Exception:
+        _swallow("fetch_products_json", base_url)
     return products
 
-def fetch_products_from_sitemap(base_url, max_items=100):
+# sitemap fallback: most product URLs collected when products.json is unavailable
+SITEMAP_MAX_ITEMS = int(os.getenv("SITEMAP_MAX_ITEMS", "100"))
+
+def fetch_products_from_sitemap(base_url, max_items=SITEMAP_MAX_ITEMS, since=None):
+    """
+    Product URLs from the store's sitemaps, streamed (see sitemaps.py). Starts at
+    /sitemap.xml and follows its product sitemaps; the per-file guesses are only
+    tried if that yields nothing. `since` skips products whose lastmod is not newer.
+    """
     base = _domain(base_url)
     urls = [
+        f"{base}/sitemap.xml",
         f"{base}/sitemap_products_1.xml",
         f"{base}/sitemap_products_2.xml",
-        f"{base}/sitemap.xml",
     ]
     products, seen = [], set()
     for u in urls:
         try:
-            r = _get(u)
-            if r.status_code != 200:
-                continue
-            soup = _soup(r.text)
-            for loc in soup.find_all("loc"):
-                href = _clean_text(loc.text)
+            for loc, _ in iter_sitemap(u, since, follow=lambda child: "product" in child.lower(), headers=REQ_HEADERS):
+                href = _clean_text(loc)
                 if "/products/" in href and href not in seen:
                     seen.add(href)
                     products.append({"url": href})
                     if len(products) >= max_items:
                         return products
         except Exception:
+            _swallow("fetch_products_from_sitemap", u)
             continue
+        if products:
+            break
     return products
 
 # -------------------------- PAGES --------------------------
 
-def extract_home_hero_products(base_url, max_items=12):
+# well-known Shopify routes tried when the homepage has no matching link
+PRIVACY_GUESSES = ["/policies/privacy-policy", "/pages/privacy-policy", "/policies/privacy"]
+REFUND_RETURN_GUESSES = {
+    "refund_policy_url": ["/policies/refund-policy", "/pages/refund-policy"],
+    "return_policy_url": ["/pages/return-policy", "/policies/return-policy"],
+}
+FAQ_GUESS = "/pages/faq"
+# excerpt lengths; their pages are only read until this much <main> text is in
+POLICY_MAX_CHARS = 4000
+ABOUT_MAX_CHARS = 1000
+
+def extract_home_hero_products(base_url, max_items=12, cache=None):
+    """
+    Products featured on the homepage: its embedded product data first (see
+    embedded.py), then /products/ links only if that came up short.
+    """
     try:
-        r = _get(base_url)
-        soup = _soup(r.text)
-        hero = []
-
-        for script in soup.select('script[type="application/ld+json"]'):
-            try:
-                data = json.loads(script.string or "{}")
-                items = data if isinstance(data, list) else [data]
-                for d in items:
-                    if isinstance(d, dict) and d.get("@type") == "Product":
-                        hero.append({
-                            "title": d.get("name"),
-                            "url": d.get("url"),
-                            "image": (d.get("image") or [None])[0] if isinstance(d.get("image"), list) else d.get("image"),
-                            "price": (d.get("offers") or {}).get("price")
-                        })
-            except Exception:
-                pass
+        page = _fetch_page(base_url, cache)
+        hero = embedded_products(page, _domain(base_url) + "/")
 
-        for a in soup.select('a[href*="/products/"]'):
-            title = _clean_text(a.get_text()) or a.get("title")
-            href = urljoin(_domain(base_url), a.get("href"))
-            if title and href:
-                hero.append({"title": title, "url": href})
+        if len(hero) < max_items:
+            for href, text, title in page.anchors:
+                if "/products/" not in href:
+                    continue
+                title = _clean_text(text) or title
+                href = urljoin(_domain(base_url), href)
+                if title and href:
+                    hero.append({"title": title, "url": href})
 
         seen, uniq = set(), []
         for p in hero:
@@ -147,84 +611,72 @@ def extract_home_hero_products(base_url, max_items=12):
                 uniq.append(p)
         return uniq[:max_items]
     except Exception:
+        _swallow("extract_home_hero_products", base_url)
         return []
 
-def find_policy_url(base_url, keywords=("privacy", "policy")):
+def find_policy_url(base_url, keywords=("privacy", "policy"), cache=None):
     try:
-        r = _get(base_url)
-        soup = _soup(r.text)
-        for a in soup.find_all("a", href=True):
-            href = a["href"].lower()
-            if any(k in href for k in keywords):
-                return urljoin(_domain(base_url), a["href"])
-        for guess in ["/policies/privacy-policy", "/pages/privacy-policy", "/policies/privacy"]:
+        if all(k in LINK_KEYWORDS for k in keywords):
+            url = _first_link(_fetch_links(base_url, cache), [l for k in keywords for l in LINK_KEYWORDS[k]])
+            if url:
+                return url
+        else:
+            for href, _, _ in _fetch_page(base_url, cache).anchors:
+                if any(k in href.lower() for k in keywords):
+                    return urljoin(_domain(base_url), href)
+        for guess in PRIVACY_GUESSES:
             test = urljoin(_domain(base_url), guess)
-            if _get(test).status_code == 200:
+            if _fetch(test, cache).status_code == 200:
                 return test
         return None
     except Exception:
+        _swallow("find_policy_url", base_url)
         return None
 
-def extract_policy_text(url, max_chars=4000):
+def extract_policy_text(url, max_chars=POLICY_MAX_CHARS, cache=None):
     if not url:
         return None
     try:
-        r = _get(url)
-        soup = _soup(r.text)
-        body = soup.select_one("main") or soup.body
-        text = _clean_text(body.get_text(" ")) if body else ""
+        main_text = _fetch_text_page(url, _enough_text(max_chars), cache).main_text
+        text = _clean_text(main_text) if main_text is not None else ""
         return text[:max_chars]
     except Exception:
+        _swallow("extract_policy_text", url)
         return None
 
-def find_refund_return_urls(base_url):
+def find_refund_return_urls(base_url, cache=None):
     found = {}
     try:
-        r = _get(base_url)
-        soup = _soup(r.text)
-        for a in soup.find_all("a", href=True):
-            href = a["href"].lower()
-            if "refund" in href and "refund_policy_url" not in found:
-                found["refund_policy_url"] = urljoin(_domain(base_url), a["href"])
-            if ("return" in href or "returns" in href) and "return_policy_url" not in found:
-                found["return_policy_url"] = urljoin(_domain(base_url), a["href"])
-        defaults = {
-            "refund_policy_url": ["/policies/refund-policy", "/pages/refund-policy"],
-            "return_policy_url": ["/pages/return-policy", "/policies/return-policy"],
-        }
-        for key, guesses in defaults.items():
+        first = _fetch_links(base_url, cache)["first"]
+        hits = [(first[label], key) for key, label in (("refund_policy_url", "refund"), ("return_policy_url", "return")) if label in first]
+        for (_, url), key in sorted(hits):
+            found[key] = url
+        for key, guesses in REFUND_RETURN_GUESSES.items():
             if key not in found:
                 for g in guesses:
                     test = urljoin(_domain(base_url), g)
-                    if _get(test).status_code == 200:
+                    if _fetch(test, cache).status_code == 200:
                         found[key] = test
                         break
     except Exception:
-        pass
+        _swallow("find_refund_return_urls", base_url)
     return found
 
-def find_faq(base_url):
+def find_faq(base_url, cache=None):
     faq_url = None
     try:
-        r = _get(base_url)
-        soup = _soup(r.text)
-        for a in soup.find_all("a", href=True):
-            href = a["href"].lower()
-            if "faq" in href or "faqs" in href or "frequently-asked" in href:
-                faq_url = urljoin(_domain(base_url), a["href"])
-                break
+        faq_url = _first_link(_fetch_links(base_url, cache), ["faq"])
         if not faq_url:
-            test = urljoin(_domain(base_url), "/pages/faq")
-            if _get(test).status_code == 200:
+            test = urljoin(_domain(base_url), FAQ_GUESS)
+            if _fetch(test, cache).status_code == 200:
                 faq_url = test
     except Exception:
-        pass
+        _swallow("find_faq", base_url)
 
     qa_pairs = []
     if faq_url:
         try:
-            rr = _get(faq_url)
-            ss = _soup(rr.text)
+            ss = _fetch_soup(faq_url, cache)
             for h in ss.select("h1,h2,h3,h4"):
                 q = _clean_text(h.get_text())
                 answer_chunks = []
@@ -242,145 +694,257 @@ def find_faq(base_url):
                     if q and a:
                         qa_pairs.append({"q": q, "a": a})
         except Exception:
-            pass
+            _swallow("find_faq", base_url)
 
     return {"url": faq_url, "qa_pairs": qa_pairs or None}
 
-def find_socials(base_url):
+def find_socials(base_url, cache=None):
     socials = {}
     try:
-        r = _get(base_url)
-        soup = _soup(r.text)
-        for a in soup.find_all("a", href=True):
-            href = a["href"]
-            if "instagram.com" in href and "instagram" not in socials:
-                socials["instagram"] = href
-            elif "facebook.com" in href and "facebook" not in socials:
-                socials["facebook"] = href
-            elif "tiktok.com" in href and "tiktok" not in socials:
-                socials["tiktok"] = href
-            elif "youtube.com" in href and "youtube" not in socials:
-                socials["youtube"] = href
-            elif "x.com" in href or "twitter.com" in href:
-                socials["twitter"] = href
+        socials = dict(_fetch_links(base_url, cache)["socials"])
     except Exception:
-        pass
+        _swallow("find_socials", base_url)
     return socials or None
 
-def find_contacts(base_url):
+def find_contacts(base_url, cache=None):
     emails, phones = set(), set()
     contact_page = None
     try:
-        r = _get(base_url)
-        soup = _soup(r.text)
-        for a in soup.find_all("a", href=True):
-            href = a["href"]
-            if href.startswith("mailto:"):
-                emails.add(href.replace("mailto:", "").strip())
-            if href.startswith("tel:"):
-                phones.add(re.sub(r"[^0-9+]", "", href.replace("tel:", "")))
-            if ("contact" in href.lower() or "support" in href.lower()) and not contact_page:
-                contact_page = urljoin(_domain(base_url), href)
-        text = soup.get_text(" ")
+        links = _fetch_links(base_url, cache)
+        emails.update(links["emails"])
+        phones.update(links["phones"])
+        contact_page = _first_link(links, ["contact_page"])
+        text = _fetch_page(base_url, cache).text
         for m in re.findall(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}", text):
             emails.add(m)
         for m in re.findall(r"(\+?\d[\d\s\-().]{7,}\d)", text):
             phones.add(re.sub(r"[^0-9+]", "", m))
     except Exception:
-        pass
+        _swallow("find_contacts", base_url)
     return {"emails": sorted(emails) or None, "phones": sorted(phones) or None, "contact_page": contact_page}
 
-def find_about(base_url):
+def find_about(base_url, cache=None):
     about_url, excerpt = None, None
     try:
-        r = _get(base_url)
-        soup = _soup(r.text)
-        meta_desc = soup.select_one('meta[name="description"], meta[property="og:description"]')
-        meta_desc = meta_desc.get("content") if meta_desc else None
-
-        for a in soup.find_all("a", href=True):
-            href = a["href"].lower()
-            if "/pages/about" in href or "about-us" in href:
-                about_url = urljoin(_domain(base_url), a["href"])
-                break
+        meta_desc = _fetch_page(base_url, cache).meta_description
+
+        about_url = _first_link(_fetch_links(base_url, cache), ["about"])
         if about_url:
-            rr = _get(about_url)
-            ss = _soup(rr.text)
-            main = ss.select_one("main") or ss.body
-            if main:
-                excerpt = _clean_text(main.get_text(" "))[:1000]
+            main_text = _fetch_text_page(about_url, _enough_text(ABOUT_MAX_CHARS), cache).main_text
+            if main_text is not None:
+                excerpt = _clean_text(main_text)[:ABOUT_MAX_CHARS]
         return {"about_url": about_url, "about_excerpt": excerpt or meta_desc}
     except Exception:
+        _swallow("find_about", base_url)
         return {"about_url": None, "about_excerpt": None}
 
-def find_important_links(base_url):
+def find_important_links(base_url, cache=None):
     links = {}
-    candidates = {
-        "order_tracking": ["track", "tracking", "order-tracking"],
-        "blog": ["blog"],
-        "contact_us": ["contact"],
-    }
     try:
-        r = _get(base_url)
-        soup = _soup(r.text)
-        for a in soup.find_all("a", href=True):
-            href_l = a["href"].lower()
-            for key, kws in candidates.items():
-                if any(k in href_l for k in kws) and key not in links:
-                    links[key] = urljoin(_domain(base_url), a["href"])
+        found = _fetch_links(base_url, cache)["first"]
+        keys = [k for k in ("order_tracking", "blog", "contact_us") if k in found]
+        for key in sorted(keys, key=lambda k: found[k][0]):
+            links[key] = found[key][1]
     except Exception:
-        pass
+        _swallow("find_important_links", base_url)
     return links or None
 
-def get_store_header(base_url):
+def get_store_header(base_url, cache=None):
     try:
-        r = _get(base_url)
-        soup = _soup(r.text)
-        title = _clean_text(soup.title.get_text()) if soup.title else None
-        meta_desc = soup.select_one('meta[name="description"], meta[property="og:description"]')
-        meta_desc = meta_desc.get("content") if meta_desc else None
+        page = _fetch_page(base_url, cache)
+        title = _clean_text(page.title) if page.title is not None else None
+        meta_desc = page.meta_description
         return {"url": _domain(base_url), "title": title, "meta_description": meta_desc}
     except Exception:
+        _swallow("get_store_header", base_url)
         return {"url": _domain(base_url), "title": None, "meta_description": None}
 
-def get_brand_context(website_url: str):
-    base = website_url if website_url.startswith("http") else f"https://{website_url}"
-
-    store = get_store_header(base)
+def _stage(fn, default, *args, **kwargs):
+    """Run one extractor; a failing stage yields its default instead of sinking the crawl."""
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        _swallow(getattr(fn, "__name__", "stage"), args[0] if args else None)
+        return default
 
-    products = fetch_products_json(base)
-    if not products:
-        products = fetch_products_from_sitemap(base)
+def _timed_stage(trace, deadline, name, fn, default, *args, **kwargs):
+    """_stage in a pool thread, timed and attributed to the crawl's trace, fetching within its deadline."""
+    start = time.perf_counter()
+    with metrics.tracing(trace), deadlines.within(deadline):
+        try:
+            return _stage(fn, default, *args, **kwargs)
+        finally:
+            metrics.record_stage(name, time.perf_counter() - start, trace)
 
-    hero_products = extract_home_hero_products(base)
+# products per whole_product_catalog event when streaming
+CATALOG_BATCH = int(os.getenv("CATALOG_BATCH", "250"))
 
-    privacy_url = find_policy_url(base, ("privacy",))
-    privacy = extract_policy_text(privacy_url)
+def _stream_catalog(base_url, emit, batch_size):
+    """Emit the catalog in batches as pages arrive; the sitemap fallback only runs if products.json gave nothing."""
+    batch, sent = [], False
+    try:
+        for p in iter_products_json(base_url):
+            batch.append(p)
+            if len(batch) >= batch_size:
+                emit(batch)
+                batch, sent = [], True
+    except Exception:
+        _swallow("_stream_catalog", base_url)
+    if batch:
+        emit(batch)
+        sent = True
+    if not sent:
+        products = fetch_products_from_sitemap(base_url)
+        if products:
+            emit(products)
+
+def _section_defaults(base):
+    """Each BrandContext section's value when its extractor fails or the crawl runs out of time."""
+    return {
+        "store": {"url": _domain(base), "title": None, "meta_description": None},
+        "hero_products": None,
+        "privacy_policy_url": None,
+        "privacy_policy_excerpt": None,
+        "refund_policy_url": None,
+        "refund_policy_excerpt": None,
+        "return_policy_url": None,
+        "return_policy_excerpt": None,
+        "brand_faqs": {"url": None, "qa_pairs": None},
+        "social_handles": None,
+        "contacts": {"emails": None, "phones": None, "contact_page": None},
+        "brand_context": {"about_url": None, "about_excerpt": None},
+        "important_links": None,
+    }
 
-    ret_urls = find_refund_return_urls(base)
-    refund_text = extract_policy_text(ret_urls.get("refund_policy_url"))
-    return_text = extract_policy_text(ret_urls.get("return_policy_url"))
+def iter_brand_context(website_url: str, cache=None, catalog=None, batch_size=CATALOG_BATCH, trace=None, deadline=None):
+    """
+    Crawl a storefront and yield (field, value) pairs as each extractor finishes.
+    Fields are BrandContext keys; "whole_product_catalog" is yielded once per batch
+    of products and the batches concatenate to the full catalog.
+    `cache` may be pre-warmed (see async_crawl); `catalog`, when given, is used
+    as the product catalog instead of fetching it. Stage timings and fetches go
+    to `trace` (default: the trace bound by metrics.tracing, if any).
+    Fetches stay within `deadline` (default: the one bound by deadlines.within).
+    Once it passes, stages still running are abandoned, the sections they owed
+    are yielded with their defaults and ("partial", True) comes last. It also
+    comes last when a stage only finished after the deadline (its fetches were
+    cut short), but not for a crawl whose stages all finished in time.
+    """
+    base = website_url if website_url.startswith("http") else f"https://{website_url}"
+    # every homepage-based extractor shares one fetch + parse through the cache
+    cache = cache if cache is not None else PageCache()
+    trace = trace if trace is not None else metrics.current()
+    deadline = deadline if deadline is not None else deadlines.current()
+    started = time.perf_counter()
+    events = queue.Queue()
+    pending = 0
+    defaults = _section_defaults(base)
+    owed = set(defaults)
+    late = False  # a stage finished after the deadline
+
+    # independent stages run side by side; _get bounds the requests per host
+    pool = ThreadPoolExecutor(max_workers=CRAWL_WORKERS)
+
+    def run(name, fn, default, *args, **kwargs):
+        nonlocal pending
+        pending += 1
+        def stage():
+            value = _timed_stage(trace, deadline, name, fn, default, *args, **kwargs)
+            events.put((name, value, deadline is not None and deadline.expired()))
+        pool.submit(stage)
+
+    def section(name, value):
+        owed.discard(name)
+        return name, value
 
-    faqs = find_faq(base)
-    socials = find_socials(base)
-    contacts = find_contacts(base)
-    brand_about = find_about(base)
-    important_links = find_important_links(base)
+    try:
+        run("store", get_store_header, defaults["store"], base, cache)
+        if catalog is None:
+            run("catalog", _stream_catalog, None, base, lambda batch: events.put(("catalog_batch", batch, False)), batch_size)
+        elif catalog:
+            yield "whole_product_catalog", catalog
+        run("hero_products", extract_home_hero_products, [], base, cache=cache)
+        run("privacy_policy_url", find_policy_url, None, base, ("privacy",), cache)
+        run("ret_urls", find_refund_return_urls, {}, base, cache)
+        run("brand_faqs", find_faq, defaults["brand_faqs"], base, cache)
+        run("social_handles", find_socials, None, base, cache)
+        run("contacts", find_contacts, defaults["contacts"], base, cache)
+        run("brand_context", find_about, defaults["brand_context"], base, cache)
+        run("important_links", find_important_links, None, base, cache)
+
+        while pending:
+            try:
+                name, value, expired = events.get(timeout=deadline.remaining() if deadline is not None else None)
+            except queue.Empty:
+                break  # out of time: stages still running are abandoned
+            if name == "catalog_batch":
+                yield "whole_product_catalog", value
+                continue
+            pending -= 1
+            late = late or expired
+            if name == "catalog":
+                continue
+            if name == "ret_urls":
+                # policy texts depend on the URLs found above
+                for key in ("refund_policy_url", "return_policy_url"):
+                    yield section(key, value.get(key))
+                    run(key.replace("_url", "_excerpt"), extract_policy_text, None, value.get(key), cache=cache)
+                continue
+            yield section(name, (value or None) if name == "hero_products" else value)
+            if name == "privacy_policy_url":
+                run("privacy_policy_excerpt", extract_policy_text, None, value, cache=cache)
+
+        # sections still owed get their defaults; a late stage may have fallen back to its default
+        # (or a shorter catalog) itself. Only those make the crawl partial, not the clock alone.
+        if owed or pending or late:
+            for name in [n for n in defaults if n in owed]:
+                yield section(name, defaults[name])
+            yield "partial", True
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        metrics.record_crawl(time.perf_counter() - started)
+        if trace is not None:
+            trace.finish()
+
+def collect_context(events):
+    """Assemble iter_brand_context's (field, value) pairs into the BrandContext-shaped dict."""
+    sections, products = {}, ProductCatalog()
+    for field, value in events:
+        if field == "whole_product_catalog":
+            if not products and isinstance(value, ProductCatalog):
+                products = ProductCatalog(value.base)
+            products.extend(value)
+        else:
+            sections[field] = value
 
     context = {
-        "store": store,
+        "store": sections["store"],
         "whole_product_catalog": products or None,
-        "hero_products": hero_products or None,
-        "privacy_policy_url": privacy_url,
-        "privacy_policy_excerpt": privacy,
-        "refund_policy_url": ret_urls.get("refund_policy_url"),
-        "refund_policy_excerpt": refund_text,
-        "return_policy_url": ret_urls.get("return_policy_url"),
-        "return_policy_excerpt": return_text,
-        "brand_faqs": faqs,
-        "social_handles": socials,
-        "contacts": contacts,
-        "brand_context": brand_about,
-        "important_links": important_links,
+        "hero_products": sections["hero_products"],
+        "privacy_policy_url": sections["privacy_policy_url"],
+        "privacy_policy_excerpt": sections["privacy_policy_excerpt"],
+        "refund_policy_url": sections["refund_policy_url"],
+        "refund_policy_excerpt": sections["refund_policy_excerpt"],
+        "return_policy_url": sections["return_policy_url"],
+        "return_policy_excerpt": sections["return_policy_excerpt"],
+        "brand_faqs": sections["brand_faqs"],
+        "social_handles": sections["social_handles"],
+        "contacts": sections["contacts"],
+        "brand_context": sections["brand_context"],
+        "important_links": sections["important_links"],
+        "partial": sections.get("partial", False),
     }
-    return context
\ No newline at end of file
+    return context
+
+def iter_context_sections(context, batch_size=CATALOG_BATCH):
+    """Replay a finished context as iter_brand_context-style (field, value) pairs."""
+    for field, value in context.items():
+        if field == "whole_product_catalog":
+            for i in range(0, len(value or []), batch_size):
+                yield field, value[i:i + batch_size]
+        else:
+            yield field, value
+
+def get_brand_context(website_url: str, cache=None, catalog=None):
+    """Crawl a storefront into a BrandContext-shaped dict (see iter_brand_context)."""
+    return collect_context(iter_brand_context(website_url, cache, catalog))
@@ -0,0 +1,242 @@
+# singleflight.py
+"""
+Single-flight crawls: concurrent requests for the same store share one crawl.
+
+join(key) makes the first caller the flight's leader; it does the work and
+finish()es the flight. Callers that join while it is in flight wait() and
+get its result, or its exception. run(key, fn) / arun(key, fn) wrap both
+sides around a function. Backends (COALESCE):
+  db    - in-process, and across gunicorn workers through the crawl_flights
+          table on the db.py engine (default)
+  local - in-process only
+  off   - no coalescing
+A leader in another worker holds the key's crawl_flights row; callers that
+find the row register as waiters and poll it, and the leader leaves its
+result in the row (for COALESCE_LINGER seconds) only when someone is
+waiting. Rows of leaders that died expire after COALESCE_TTL seconds. A
+caller whose wait ends without a result (the leader gave up, failed in
+another worker or timed out) does the work itself, and a database that
+fails never blocks a crawl.
+"""
+import os
+import time
+import uuid
+import asyncio
+import logging
+import threading
+
+import orjson
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+import deadlines
+import metrics
+from catalog import json_default
+
+log = logging.getLogger(__name__)
+
+BACKEND = os.getenv("COALESCE", "db")
+TTL = float(os.getenv("COALESCE_TTL", "300"))
+LINGER = float(os.getenv("COALESCE_LINGER", "30"))
+POLL_INTERVAL = float(os.getenv("COALESCE_POLL", "0.25"))
+
+# wait() result when the caller has to do the work itself
+MISSING = object()
+
+
+class _Local:
+    """A flight as seen inside this process."""
+
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = MISSING
+        self.error = None
+
+
+_flights = {}
+_lock = threading.Lock()
+
+
+def _engine():
+    from db import ENGINE
+    return ENGINE
+
+
+# -------------------------- crawl_flights rows --------------------------
+
+def _claim(key, owner):
+    """True when this caller now holds the key's row, False when another live row exists."""
+    now = time.time()
+    engine = _engine()
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM crawl_flights WHERE store_key = :k AND expires_at < :t"), {"k": key, "t": now})
+    try:
+        with engine.begin() as conn:
+            conn.execute(
+                text("INSERT INTO crawl_flights (store_key, owner, status, waiters, expires_at) "
+                     "VALUES (:k, :o, 'running', 0, :e)"),
+                {"k": key, "o": owner, "e": now + TTL}
+            )
+        return True
+    except IntegrityError:
+        return False
+
+
+def _await_row(key, timeout):
+    """The result another worker leaves in the key's row, or MISSING."""
+    engine = _engine()
+    with engine.begin() as conn:
+        conn.execute(
+            text("UPDATE crawl_flights SET waiters = waiters + 1 WHERE store_key = :k AND status = 'running'"),
+            {"k": key}
+        )
+    deadline = time.monotonic() + timeout
+    while True:
+        with engine.connect() as conn:
+            row = conn.execute(
+                text("SELECT status, result_json, expires_at FROM crawl_flights WHERE store_key = :k"), {"k": key}
+            ).first()
+        if row is None or row[2] < time.time():
+            return MISSING
+        if row[0] == "done":
+            return orjson.loads(row[1]) if row[1] is not None else MISSING
+        if time.monotonic() >= deadline:
+            return MISSING
+        time.sleep(POLL_INTERVAL)
+
+
+def _release(key, owner, value):
+    """Drop the row, or hand value to the workers waiting on it."""
+    with _engine().begin() as conn:
+        if value is MISSING:
+            conn.execute(text("DELETE FROM crawl_flights WHERE store_key = :k AND owner = :o"), {"k": key, "o": owner})
+            return
+        res = conn.execute(
+            text("DELETE FROM crawl_flights WHERE store_key = :k AND owner = :o AND waiters = 0"), {"k": key, "o": owner}
+        )
+        if res.rowcount:
+            return
+        conn.execute(
+            text("UPDATE crawl_flights SET status = 'done', result_json = :r, expires_at = :e "
+                 "WHERE store_key = :k AND owner = :o"),
+            {"r": orjson.dumps(value, default=json_default), "e": time.time() + LINGER, "k": key, "o": owner}
+        )
+
+
+# -------------------------- flights --------------------------
+
+class Flight:
+    """One caller's part in a flight: the leader does the work and finish()es it, everyone else wait()s."""
+
+    def __init__(self, key, local, leader, owns_local, owner=None):
+        self.key = key
+        self.leader = leader
+        self._local = local
+        self._owns_local = owns_local   # this caller completes the in-process flight
+        self._owner = owner             # crawl_flights row owner id, when this caller holds the row
+
+    def wait(self, timeout=None):
+        """
+        The leader's result (re-raising its exception), or MISSING: then do the
+        work and finish(). Waits at most COALESCE_TTL, or until the deadline.
+        """
+        if timeout is None:
+            timeout = min(TTL, deadlines.remaining())
+        if not self._owns_local:
+            if not self._local.done.wait(timeout):
+                return MISSING
+            if self._local.error is not None:
+                raise self._local.error
+            if self._local.value is not MISSING:
+                metrics.record_coalesced("process")
+            return self._local.value
+        # this process's leader, following a leader in another worker
+        try:
+            value = _await_row(self.key, timeout)
+        except Exception:
+            log.debug("crawl flight unavailable for %s", self.key, exc_info=True)
+            value = MISSING
+        self.leader = True
+        if value is not MISSING:
+            metrics.record_coalesced("database")
+            self.finish(value)
+        return value
+
+    def finish(self, value=MISSING, error=None):
+        """Complete the flight with value or error; with neither, waiters do the work themselves."""
+        if self._owner is not None:
+            owner, self._owner = self._owner, None
+            try:
+                _release(self.key, owner, MISSING if error is not None else value)
+            except Exception:
+                log.debug("crawl flight unavailable for %s", self.key, exc_info=True)
+        if self._owns_local:
+            self._owns_local = False
+            self._local.value, self._local.error = value, error
+            with _lock:
+                if _flights.get(self.key) is self._local:
+                    del _flights[self.key]
+            self._local.done.set()
+
+
+def join(key):
+    """This caller's Flight for key; check .leader."""
+    if BACKEND == "off":
+        return Flight(key, _Local(), True, False)
+    with _lock:
+        local = _flights.get(key)
+        if local is not None:
+            return Flight(key, local, False, False)
+        local = _flights[key] = _Local()
+    if BACKEND != "db":
+        return Flight(key, local, True, True)
+    owner = uuid.uuid4().hex
+    try:
+        claimed = _claim(key, owner)
+    except Exception:
+        log.debug("crawl flight unavailable for %s", key, exc_info=True)
+        claimed, owner = True, None
+    if claimed:
+        return Flight(key, local, True, True, owner)
+    return Flight(key, local, False, True)
+
+
+def run(key, fn):
+    """fn() once for every concurrent caller with the same key."""
+    flight = join(key)
+    if not flight.leader:
+        value = flight.wait()
+        if value is not MISSING:
+            return value
+    try:
+        value = fn()
+    except Exception as e:
+        flight.finish(error=e)
+        raise
+    except BaseException:
+        flight.finish()
+        raise
+    flight.finish(value)
+    return value
+
+
+async def arun(key, fn):
+    """run() for a coroutine function; joining and waiting happen in worker threads."""
+    flight = await asyncio.to_thread(join, key)
+    if not flight.leader:
+        value = await asyncio.to_thread(flight.wait)
+        if value is not MISSING:
+            return value
+    # finish() is not awaited on failure: a cancelled crawl still has to release its waiters
+    try:
+        value = await fn()
+    except Exception as e:
+        flight.finish(error=e)
+        raise
+    except BaseException:
+        flight.finish()
+        raise
+    await asyncio.to_thread(flight.finish, value)
+    return value